@@ -4,16 +4,26 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
 from accounts.models import UserProfile
+from project.images import get_variant_urls
 
 
 class ProfileSerializer(serializers.ModelSerializer):
     """Base profile serializer"""
 
+    avatar_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = UserProfile
-        fields = ("name", "about", "avatar", "user")
+        fields = ("name", "about", "avatar", "avatar_variants", "user")
         read_only_fields = ("user",)
 
+    def get_avatar_variants(self, obj):
+        """Resized and WebP avatars, empty until the avatar is processed"""
+        storage = UserProfile._meta.get_field("avatar").storage
+        return get_variant_urls(
+            obj.avatar_variants, storage, self.context.get("request")
+        )
+
 
 class CreateProfileSerializer(serializers.ModelSerializer):
     """Serializer for creating user and user's profile"""
@@ -1,4 +1,6 @@
 from django.urls import path
+
+from project.threadpool import read_view
 from .views import CreateProfileView, UpdateProfileView
 
 app_name = "accounts"
@@ -8,7 +10,7 @@ urlpatterns = [
     path("user/registration/", CreateProfileView.as_view(), name="create_user"),
     path(
         "user/<slug:username>/update/",
-        UpdateProfileView.as_view(),
+        read_view(UpdateProfileView.as_view()),
         name="update_user_profile",
     ),
 ]
@@ -0,0 +1,85 @@
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import AccessToken, Application
+from oauth2_provider.oauth2_validators import OAuth2Validator
+from oauth2_provider.settings import oauth2_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.oauth2_validators import CachedOAuth2Validator
+from accounts.tokens import evict_tokens
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare queries and time per request of OAuth2 token authentication "
+        "with OAuth2Validator and CachedOAuth2Validator"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=1000, help="Requests authenticated per run"
+        )
+
+    def handle(self, *args, **options):
+        # Token of the benchmark is rolled back afterwards
+        with transaction.atomic():
+            token = self.create_token()
+            try:
+                for validator_class in (OAuth2Validator, CachedOAuth2Validator):
+                    self.measure(validator_class, token, options["requests"])
+            finally:
+                evict_tokens([token])
+                transaction.set_rollback(True)
+
+    def create_token(self):
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(f"benchmark_{suffix}")
+        application = Application.objects.create(
+            name="benchmark",
+            user=user,
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_PASSWORD,
+        )
+        access_token = AccessToken.objects.create(
+            user=user,
+            application=application,
+            token=uuid.uuid4().hex,
+            scope="read write",
+            expires=timezone.now() + timedelta(hours=1),
+        )
+        return access_token.token
+
+    def measure(self, validator_class, token, requests):
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        authentication = OAuth2Authentication()
+        patch = mock.patch.object(
+            oauth2_settings, "OAUTH2_VALIDATOR_CLASS", validator_class
+        )
+        with patch:
+            # Warm up, so cache is measured when it's filled
+            authentication.authenticate(Request(request))
+
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                for _ in range(requests):
+                    authentication.authenticate(Request(request))
+                elapsed = time.perf_counter() - start
+
+        queries = len(context.captured_queries)
+        self.stdout.write(
+            f"{validator_class.__name__}: {queries / requests:.1f} queries, "
+            f"{elapsed / requests * 1000:.3f} ms per request"
+        )
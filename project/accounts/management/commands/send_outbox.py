@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = (
+        "Send emails queued in outbox in batches, each over one connection, "
+        "and retry failed ones later"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Emails sent over one connection, ACCOUNTS_OUTBOX_BATCH_SIZE by default",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait when outbox has no due emails",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no emails are due"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = OutgoingEmail.objects.send_batch(options["batch_size"])
+            if sent:
+                self.stdout.write(f"Sent {sent} emails")
+            # Due rows locked by another worker are skipped, wait for it
+            if sent and OutgoingEmail.objects.due().exists():
+                continue
+            if options["once"]:
+                return
+            close_old_connections()
+            time.sleep(options["interval"])
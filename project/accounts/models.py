@@ -1,32 +1,179 @@
-from django.db import models
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core import mail
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 from django.dispatch import receiver
 from django.urls import reverse
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.core.mail import send_mail
+from oauth2_provider.models import AccessToken, Application
+
+from project.images import ProcessedImageMixin, validate_image_size
+from .tokens import evict_tokens, evict_tokens_of
 
 
 User = get_user_model()
 
 
-class UserProfile(models.Model):
+class UserProfile(ProcessedImageMixin, models.Model):
     """User's profile with additional information"""
 
+    image_field = "avatar"
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     name = models.CharField(max_length=60, default="")
     about = models.TextField(max_length=1500, default="", blank=True)
-    avatar = models.ImageField(null=True, blank=True)
+    avatar = models.ImageField(null=True, blank=True, validators=[validate_image_size])
+    # Processed files of the avatar, see project.images
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_moderator = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Avatars waiting for process_images command
+            models.Index(
+                name="accounts_avatar_pending",
+                fields=["id"],
+                condition=models.Q(avatar__gt="", avatar_variants={}),
+            ),
+        ]
+
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            skip = set(self.get_deferred_fields()) | self.get_image_skip_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skip
+            ]
+        super().save(*args, **kwargs)
+        self.image_saved()
+
     def set_user_as_moderator(self):
         self.is_moderator = True
         self.save()
 
 
+class OutgoingEmailQuerySet(models.QuerySet):
+    def queue(self, subject, message, from_email, recipient_list):
+        """
+        Same as send_mail, but the email is stored to be sent by
+        send_outbox command once the transaction commits
+        """
+        return self.create(
+            subject=subject,
+            body=message,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            to=list(recipient_list),
+        )
+
+    def due(self):
+        return self.filter(status="pending", send_after__lte=timezone.now())
+
+    def send_batch(self, size=None):
+        """
+        Send due emails over one connection, returns how many were sent.
+
+        Rows are locked until results are saved, skipping rows locked
+        by other workers, so several workers can run at once
+        """
+        size = size or settings.ACCOUNTS_OUTBOX_BATCH_SIZE
+        with transaction.atomic(using=self.db):
+            emails = list(
+                self.due()
+                .select_for_update(skip_locked=True)
+                .order_by("send_after", "id")[:size]
+            )
+            if not emails:
+                return 0
+
+            connection = mail.get_connection()
+            try:
+                connection.open()
+            except (smtplib.SMTPException, OSError) as exc:
+                for email in emails:
+                    email.retry_later(exc)
+            else:
+                try:
+                    for email in emails:
+                        email.send(connection)
+                finally:
+                    connection.close()
+
+            self.bulk_update(
+                emails, ["status", "attempts", "send_after", "sent", "last_error"]
+            )
+        return sum(1 for email in emails if email.status == "sent")
+
+
+class OutgoingEmail(models.Model):
+    """Email waiting in outbox for send_outbox command"""
+
+    STATUS = (("pending", "pending"), ("sent", "sent"), ("failed", "failed"))
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = ArrayField(models.CharField(max_length=255))
+    status = models.CharField(max_length=7, choices=STATUS, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    objects = OutgoingEmailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Due emails, see OutgoingEmailQuerySet.due
+            models.Index(
+                name="accounts_outbox_pending",
+                fields=["send_after", "id"],
+                condition=models.Q(status="pending"),
+            ),
+        ]
+
+    def __str__(self):
+        return self.subject
+
+    def send(self, connection):
+        # Any error, e.g. BadHeaderError of a bad address, fails only this
+        # email, the rest of the batch is still sent and saved
+        try:
+            mail.EmailMessage(
+                self.subject, self.body, self.from_email, self.to, connection=connection
+            ).send()
+        except Exception as exc:
+            self.retry_later(exc)
+        else:
+            self.status = "sent"
+            self.sent = timezone.now()
+            self.attempts += 1
+
+    def retry_later(self, error):
+        """Back off exponentially, give up after ACCOUNTS_OUTBOX_MAX_ATTEMPTS"""
+        self.attempts += 1
+        self.last_error = repr(error)
+        if self.attempts >= settings.ACCOUNTS_OUTBOX_MAX_ATTEMPTS:
+            self.status = "failed"
+            return
+        delay = min(
+            settings.ACCOUNTS_OUTBOX_RETRY_SECONDS * 2 ** (self.attempts - 1),
+            settings.ACCOUNTS_OUTBOX_RETRY_MAX_SECONDS,
+        )
+        self.send_after = timezone.now() + timedelta(seconds=delay)
+
+
 # Send email for password reset
 @receiver(reset_password_token_created)
 def password_reset_token_created(
@@ -37,7 +184,8 @@ def password_reset_token_created(
         reverse("password_reset:reset-password-request"), reset_password_token.key
     )
 
-    send_mail(
+    # Sent by send_outbox command, SMTP doesn't slow down the request
+    OutgoingEmail.objects.queue(
         # title:
         "Password Reset for {title}".format(title="Some website title"),
         # message:
@@ -47,3 +195,24 @@ def password_reset_token_created(
         # to:
         [reset_password_token.user.email],
     )
+
+
+# Cached access tokens keep their user and application, see accounts.tokens
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def evict_access_token(sender, instance, **kwargs):
+    evict_tokens([instance.token])
+
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # Login only updates last_login, which tokens don't depend on
+    if created or update_fields == frozenset(["last_login"]):
+        return
+    evict_tokens_of(user=instance)
+
+
+@receiver(post_save, sender=Application)
+def evict_application_tokens(sender, instance, created, **kwargs):
+    if not created:
+        evict_tokens_of(application=instance)
@@ -0,0 +1,27 @@
+from oauth2_provider.oauth2_validators import OAuth2Validator
+
+from .tokens import cache_token, get_cached_token
+
+
+class CachedOAuth2Validator(OAuth2Validator):
+    """
+    Validator which loads access tokens from cache, see get_cached_token.
+
+    Expiry and scopes of cached tokens are checked the same way,
+    tokens which fail the checks are validated from database
+    """
+
+    def validate_bearer_token(self, token, scopes, request):
+        access_token = get_cached_token(token) if token else None
+        if access_token is None or not access_token.is_valid(scopes):
+            # Errors of invalid tokens are set on request as usual
+            valid = super().validate_bearer_token(token, scopes, request)
+            if valid:
+                cache_token(request.access_token)
+            return valid
+
+        request.client = access_token.application
+        request.user = access_token.user
+        request.scopes = scopes
+        request.access_token = access_token
+        return True
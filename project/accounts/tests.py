@@ -1,11 +1,30 @@
+import importlib
+import os
+import smtplib
+import sys
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import AccessToken, Application
 from rest_framework import status
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 
 from .api.serializer import UpdateProfileSerializer
-from .models import UserProfile
+from .models import OutgoingEmail, UserProfile
+from .oauth2_validators import CachedOAuth2Validator
+from .tokens import local_tokens
 
 User = get_user_model()
 
@@ -251,3 +270,194 @@ class TestUpdateProfile(APITestCase):
         }
         response = self.auth_client.patch(self.update_url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestCachedTokenAuthentication(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.user = User.objects.create_user("test", "test@gmail.com", "password")
+        application = Application.objects.create(
+            name="app",
+            user=self.user,
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_PASSWORD,
+        )
+        self.access_token = AccessToken.objects.create(
+            user=self.user,
+            application=application,
+            token="secret-token",
+            scope="read write",
+            expires=timezone.now() + timedelta(hours=1),
+        )
+
+    def authenticate(self):
+        request = APIRequestFactory().get(
+            "/", HTTP_AUTHORIZATION=f"Bearer {self.access_token.token}"
+        )
+        return OAuth2Authentication().authenticate(Request(request))
+
+    def test_token_is_validated_from_cache(self):
+        """Ensure only the first request loads the token from database"""
+
+        with self.assertNumQueries(1):
+            user, access_token = self.authenticate()
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.authenticate()
+
+        self.assertEqual(cached_user, self.user)
+        self.assertEqual(cached_token, access_token)
+        self.assertEqual(cached_token.application, self.access_token.application)
+
+        # Other processes share the validated token too
+        local_tokens.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate()[0], self.user)
+
+    def test_scopes(self):
+        """Ensure cached tokens pass the same scope checks"""
+
+        self.authenticate()
+        request = mock.Mock()
+        validator = CachedOAuth2Validator()
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                validator.validate_bearer_token("secret-token", ["read"], request)
+            )
+        self.assertFalse(
+            validator.validate_bearer_token("secret-token", ["groups"], request)
+        )
+
+    def test_expired_token(self):
+        """Ensure cached token isn't accepted after it expires"""
+
+        self.authenticate()
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertIsNone(self.authenticate())
+
+    def test_revoked_token(self):
+        """Ensure revoked or changed token is evicted from cache"""
+
+        self.authenticate()
+        self.access_token.scope = "read"
+        self.access_token.save()
+        self.assertEqual(self.authenticate()[1].scope, "read")
+
+        self.access_token.revoke()
+        self.assertIsNone(self.authenticate())
+
+    def test_changed_user(self):
+        """Ensure tokens of changed user are evicted from cache"""
+
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate()
+        self.assertFalse(user.is_active)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_token_auth", requests=5, stdout=out)
+        self.assertIn("CachedOAuth2Validator: 0.0 queries", out.getvalue())
+
+    def test_production_requires_shared_cache(self):
+        """Ensure other processes can't keep accepting evicted tokens"""
+
+        for url in ("locmemcache://", "dummycache://"):
+            environ = mock.patch.dict(os.environ, CACHE_URL=url)
+            with environ, mock.patch.dict(sys.modules):
+                sys.modules.pop("project.settings_production", None)
+                with self.assertRaisesMessage(ImproperlyConfigured, "shared"):
+                    importlib.import_module("project.settings_production")
+
+
+class TestOutbox(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@gmail.com", "password")
+
+    def test_password_reset_is_queued(self):
+        """Ensure password reset request doesn't wait for the email"""
+
+        url = reverse("password_reset:reset-password-request")
+        response = self.client.post(url, {"email": "test@gmail.com"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to, ["test@gmail.com"])
+        self.assertEqual(email.status, "pending")
+
+        call_command("send_outbox", once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, email.subject)
+        email.refresh_from_db()
+        self.assertEqual(email.status, "sent")
+
+    def test_batch_uses_one_connection(self):
+        for i in range(5):
+            OutgoingEmail.objects.queue("Subject", "Body", None, [f"{i}@gmail.com"])
+
+        with mock.patch.object(
+            EmailBackend, "open", autospec=True, return_value=True
+        ) as open_connection:
+            sent = OutgoingEmail.objects.send_batch(size=3)
+        self.assertEqual(sent, 3)
+        self.assertEqual(open_connection.call_count, 1)
+
+        out = StringIO()
+        call_command("send_outbox", once=True, batch_size=3, stdout=out)
+        self.assertEqual(out.getvalue(), "Sent 2 emails\n")
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_wait_for_other_worker(self):
+        """Ensure emails locked by another worker aren't polled in a loop"""
+
+        OutgoingEmail.objects.queue("Subject", "Body", None, ["a@gmail.com"])
+        locked = mock.patch.object(OutgoingEmail.objects, "send_batch", return_value=0)
+        sleep = mock.patch("time.sleep", side_effect=[None, KeyboardInterrupt])
+        with locked as send_batch, sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("send_outbox", interval=1, stdout=StringIO())
+        self.assertEqual(send_batch.call_count, 2)
+
+    def test_bad_email_fails_alone(self):
+        """Ensure an email which can't be sent doesn't roll back the batch"""
+
+        OutgoingEmail.objects.queue("Bad\nsubject", "Body", None, ["a@gmail.com"])
+        OutgoingEmail.objects.queue("Subject", "Body", None, ["b@gmail.com"])
+
+        self.assertEqual(OutgoingEmail.objects.send_batch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        bad, good = OutgoingEmail.objects.order_by("id")
+        self.assertEqual(good.status, "sent")
+        self.assertEqual(bad.status, "pending")
+        self.assertIn("BadHeaderError", bad.last_error)
+        self.assertGreater(bad.send_after, timezone.now())
+
+    def test_retry_with_backoff(self):
+        """Ensure failed email is retried later and given up eventually"""
+
+        email = OutgoingEmail.objects.queue("Subject", "Body", None, ["a@gmail.com"])
+        failure = mock.patch.object(
+            EmailBackend, "send_messages", side_effect=smtplib.SMTPException("down")
+        )
+        delays = []
+        with failure, self.settings(ACCOUNTS_OUTBOX_MAX_ATTEMPTS=3):
+            for _ in range(3):
+                self.assertEqual(OutgoingEmail.objects.send_batch(), 0)
+                # Not due until the delay passes
+                self.assertEqual(OutgoingEmail.objects.send_batch(), 0)
+
+                email.refresh_from_db()
+                delays.append((email.send_after - timezone.now()).total_seconds())
+                OutgoingEmail.objects.update(send_after=timezone.now())
+
+        self.assertEqual(email.status, "failed")
+        self.assertEqual(email.attempts, 3)
+        self.assertIn("down", email.last_error)
+        self.assertAlmostEqual(delays[0], 30, delta=1)
+        self.assertAlmostEqual(delays[1], 60, delta=1)
+        self.assertEqual(OutgoingEmail.objects.send_batch(), 0)
+        self.assertEqual(len(mail.outbox), 0)
@@ -0,0 +1,130 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from oauth2_provider.models import AccessToken
+
+
+class LocalTokens:
+    """
+    In-process cache of validated tokens, at most max_size of them.
+
+    Every entry expires after its own timeout, the oldest stored
+    entries are evicted first
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            return item[1]
+
+    def set(self, key, data, timeout):
+        if timeout <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.monotonic() + timeout, data)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+local_tokens = LocalTokens(settings.ACCOUNTS_TOKEN_LOCAL_MAX_SIZE)
+
+
+def _key(token):
+    # Tokens are credentials, so they aren't stored in keys as they are
+    return "accounts:token:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_cached_token(token):
+    """
+    Access token with its user and application validated earlier or None.
+
+    Tokens are copied from pickled data on every call,
+    so requests never share model instances
+    """
+    key = _key(token)
+    data = local_tokens.get(key)
+    if data is not None:
+        return pickle.loads(data)
+
+    data = cache.get(key)
+    if data is None:
+        return None
+    access_token = pickle.loads(data)
+    local_tokens.set(
+        key, data, _timeout(access_token, settings.ACCOUNTS_TOKEN_LOCAL_TIMEOUT)
+    )
+    return access_token
+
+
+def cache_token(access_token):
+    """Keep valid token for its remaining lifetime at most"""
+    key = _key(access_token.token)
+    data = pickle.dumps(access_token)
+    timeout = int(_timeout(access_token, settings.ACCOUNTS_TOKEN_CACHE_TIMEOUT))
+    if timeout > 0:
+        cache.set(key, data, timeout)
+    local_tokens.set(
+        key, data, _timeout(access_token, settings.ACCOUNTS_TOKEN_LOCAL_TIMEOUT)
+    )
+
+
+def _timeout(access_token, timeout):
+    remaining = (access_token.expires - timezone.now()).total_seconds()
+    return min(remaining, timeout)
+
+
+def evict_tokens(tokens):
+    """
+    Drop cached tokens, call it when they are changed or revoked.
+
+    They are dropped again after commit, in case a request has cached
+    the old state meanwhile. With a cache shared by processes, which
+    production settings require, memory of other processes keeps them
+    for ACCOUNTS_TOKEN_LOCAL_TIMEOUT seconds at most
+    """
+    keys = [_key(token) for token in tokens]
+    if not keys:
+        return
+
+    def evict():
+        for key in keys:
+            local_tokens.delete(key)
+        cache.delete_many(keys)
+
+    evict()
+    transaction.on_commit(evict)
+
+
+def evict_tokens_of(**filters):
+    """Drop cached tokens of a user or an application"""
+    evict_tokens(AccessToken.objects.filter(**filters).values_list("token", flat=True))
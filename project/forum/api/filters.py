@@ -0,0 +1,47 @@
+from django.db.models import F
+
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+
+class TopicSearchFilter(SearchFilter):
+    """
+    Full-text search of topics by title, description and comments.
+
+    Uses GIN-indexed search vectors of topics and comments instead of ILIKE
+    scan, results are ordered by relevance
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "").strip()
+        if not text:
+            return queryset
+        return queryset.search(text)
+
+
+class TopicOrderingFilter(OrderingFilter):
+    """
+    Order topics by "?ordering=" parameter, id breaks ties.
+
+    Without the parameter queryset ordering (e.g. search rank) is kept
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if "id" not in ordering and "-id" not in ordering:
+            ordering.append("-id")
+        return ordering
+
+    def filter_queryset(self, request, queryset, view):
+        if self.ordering_param not in request.query_params:
+            return queryset
+
+        ordering = []
+        for field in self.get_ordering(request, queryset, view):
+            # Topics without comments go after active ones,
+            # matches index on (last_comment_at DESC NULLS LAST, id DESC)
+            if field == "-last_comment_at":
+                field = F("last_comment_at").desc(nulls_last=True)
+            elif field == "last_comment_at":
+                field = F("last_comment_at").asc(nulls_first=True)
+            ordering.append(field)
+        return queryset.order_by(*ordering)
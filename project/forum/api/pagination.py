@@ -0,0 +1,35 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class TopicCursorPagination(CursorPagination):
+    """Keyset pagination for topics, newest first"""
+
+    ordering = ("-created", "-id")
+
+
+class CommentCursorPagination(CursorPagination):
+    """Keyset pagination for comments in order they were left"""
+
+    ordering = ("created", "id")
+
+
+class CursorOrPageNumberMixin:
+    """
+    Paginate by opaque "?cursor=" tokens without counting rows.
+
+    Clients that need page numbers and total count can still send "?page="
+    """
+
+    page_number_pagination_class = PageNumberPagination
+    page_number_params = ("page",)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            request = getattr(self, "request", None)
+            params = request.query_params if request is not None else {}
+            if any(param in params for param in self.page_number_params):
+                self._paginator = self.page_number_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -14,7 +14,8 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Instance must have an attribute named `author`.
-        return obj.author == request.user
+        # Ids are compared, so the author isn't loaded
+        return obj.author_id == request.user.id
 
 
 class IsModeratorOrOwner(permissions.BasePermission):
@@ -33,8 +34,8 @@ class IsModeratorOrOwner(permissions.BasePermission):
         # if request.method in permissions.SAFE_METHODS:
         #     return True
 
-        owner =  obj.author == request.user
-        moderator = obj.moderator == request.user
+        owner = obj.author_id == request.user.id
+        moderator = obj.moderator_id == request.user.id
 
         if owner or moderator:
             return True
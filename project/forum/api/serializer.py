@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model
 
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.reverse import reverse
 
-from forum.models import Topic, Comment
+from forum.models import Topic, Comment, COMMENT_PREVIEW_SIZE
+from project.images import get_variant_urls
 
 User = get_user_model()
 
@@ -18,12 +21,29 @@ class CommentSerializer(serializers.ModelSerializer):
         read_only_fields = ("topic", "status")
 
 
+class BulkCommentSerializer(serializers.ModelSerializer):
+    """Serializer for one comment of a batch, topic is checked by the view"""
+
+    topic = serializers.IntegerField()
+
+    class Meta:
+        model = Comment
+        fields = ("content", "topic")
+
+
 class TopicSerializer(serializers.ModelSerializer):
     """Serializer for crud Topic"""
 
     author = serializers.SlugRelatedField(slug_field="username", read_only=True)
     moderator = serializers.SlugRelatedField(slug_field="username", read_only=True)
-    comment_set = CommentSerializer(many=True, read_only=True)
+    last_comment_author = serializers.SlugRelatedField(
+        slug_field="username", read_only=True
+    )
+    image_variants = serializers.SerializerMethodField()
+    comments = serializers.SerializerMethodField()
+    comments_url = serializers.HyperlinkedIdentityField(
+        view_name="forum:create_comment", lookup_url_kwarg="topic"
+    )
 
     updated = serializers.DateTimeField(read_only=True)
 
@@ -34,15 +54,37 @@ class TopicSerializer(serializers.ModelSerializer):
             "title",
             "description",
             "image",
+            "image_variants",
             "author",
             "moderator",
             "created",
             "updated",
             "is_active",
             "closed",
-            "comment_set",
+            "comment_count",
+            "last_comment_at",
+            "last_comment_author",
+            "comments",
+            "comments_url",
         )
 
+    def get_image_variants(self, obj):
+        """Resized and WebP images, empty until the image is processed"""
+        storage = Topic._meta.get_field("image").storage
+        return get_variant_urls(
+            obj.image_variants, storage, self.context.get("request")
+        )
+
+    def get_comments(self, obj):
+        """The newest comments, full thread is available by comments_url"""
+        if hasattr(obj, "comment_preview"):
+            comments = obj.comment_preview
+        else:
+            comments = obj.comment_set.select_related("author").order_by(
+                "-created", "-id"
+            )[: self.context.get("preview_size", COMMENT_PREVIEW_SIZE)]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
 
 class CommentEditSerializer(serializers.ModelSerializer):
     """Serializer for editing comment"""
@@ -55,15 +97,15 @@ class CommentEditSerializer(serializers.ModelSerializer):
         read_only_fields = ("topic", "status")
 
     def update(self, instance, validated_data):
-        if instance.topic.closed:
-            msg = "Topic is closed. You can not leave comment here"
-            raise serializers.ValidationError(msg)
         for field, value in validated_data.items():
             if value:
                 setattr(instance, field, value)
 
-        instance.update_comment()
-        instance.save()
+        if not instance.update_comment():
+            if Comment.objects.filter(pk=instance.pk, status="deleted").exists():
+                raise NotFound("Comment was deleted")
+            msg = "Topic is closed. You can not leave comment here"
+            raise serializers.ValidationError(msg)
         return instance
 
 
@@ -78,8 +120,9 @@ class DeleteCommentSerializer(serializers.ModelSerializer):
         read_only_fields = ("topic", "status", "content")
 
     def update(self, instance, validated_data):
-        instance.delete_comment()
-        instance.save()
+        if not instance.delete_comment():
+            msg = "Topic is closed. You can not delete comment here"
+            raise serializers.ValidationError(msg)
         return instance
 
 
@@ -91,6 +134,167 @@ class AttachModeratorSerializer(serializers.ModelSerializer):
         fields = ("moderator",)
 
     def update(self, instance, validated_data):
-        moderator = User.objects.get(username=validated_data.get("moderator"))
-        instance.set_user_as_moderator(moderator)
+        instance.set_user_as_moderator(validated_data["moderator"])
         return instance
+
+
+class ModeratorAssignmentSerializer(serializers.Serializer):
+    """Serializer for attaching user to many topics as moderator at once"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+    moderator = serializers.SlugRelatedField(
+        slug_field="username", queryset=User.objects.all()
+    )
+
+
+class TopicModerationSerializer(serializers.Serializer):
+    """Serializer for closing or hiding many topics at once"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+    action = serializers.ChoiceField(choices=("close", "deactivate"))
+
+
+class CommentModerationSerializer(serializers.Serializer):
+    """Serializer for deleting many comments at once, by ids or of one author"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000,
+        required=False,
+    )
+    author = serializers.SlugRelatedField(
+        slug_field="username", queryset=User.objects.all(), required=False
+    )
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("Send comment ids or author")
+        return attrs
+
+
+class CommentRowSerializer:
+    """
+    Read-only CommentSerializer for list endpoints.
+
+    Builds the same output straight from values() rows, without model
+    instances and field walking
+    """
+
+    values = (
+        "id",
+        "content",
+        "author__username",
+        "status",
+        "created",
+        "updated",
+        "topic",
+    )
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.datetime = serializers.DateTimeField()
+
+    def to_representation(self, row):
+        return {
+            "id": row["id"],
+            "content": row["content"],
+            "author": row["author__username"],
+            "status": row["status"],
+            "created": self.datetime.to_representation(row["created"]),
+            "updated": self.datetime.to_representation(row["updated"]),
+            "topic": row["topic"],
+        }
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class TopicRowSerializer:
+    """
+    Read-only TopicSerializer for list endpoints.
+
+    Builds the same output straight from values() rows, comment previews
+    are loaded by one more query
+    """
+
+    values = (
+        "id",
+        "title",
+        "description",
+        "image",
+        "image_variants",
+        "author__username",
+        "moderator__username",
+        "created",
+        "updated",
+        "is_active",
+        "closed",
+        "comment_count",
+        "last_comment_at",
+        "last_comment_author__username",
+    )
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.request = self.context.get("request")
+        self.datetime = serializers.DateTimeField()
+        self.comments = CommentRowSerializer(context)
+        self.storage = Topic._meta.get_field("image").storage
+
+    def to_representation(self, row, comments=()):
+        last_comment_at = row["last_comment_at"]
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "description": row["description"],
+            "image": self.get_image(row["image"]),
+            "image_variants": get_variant_urls(
+                row["image_variants"], self.storage, self.request
+            ),
+            "author": row["author__username"],
+            "moderator": row["moderator__username"],
+            "created": self.datetime.to_representation(row["created"]),
+            "updated": self.datetime.to_representation(row["updated"]),
+            "is_active": row["is_active"],
+            "closed": row["closed"],
+            "comment_count": row["comment_count"],
+            "last_comment_at": (
+                self.datetime.to_representation(last_comment_at)
+                if last_comment_at is not None
+                else None
+            ),
+            "last_comment_author": row["last_comment_author__username"],
+            "comments": self.comments.many(comments),
+            "comments_url": reverse(
+                "forum:create_comment",
+                kwargs={"topic": row["id"]},
+                request=self.request,
+            ),
+        }
+
+    def many(self, rows):
+        rows = list(rows)
+        preview_size = self.context.get("preview_size", COMMENT_PREVIEW_SIZE)
+
+        previews = {row["id"]: [] for row in rows}
+        if rows and preview_size:
+            comments = Comment.objects.newest_per_topic(preview_size).filter(
+                topic__in=previews
+            )
+            for comment in comments.values(*CommentRowSerializer.values):
+                previews[comment["topic"]].append(comment)
+
+        return [self.to_representation(row, previews[row["id"]]) for row in rows]
+
+    def get_image(self, name):
+        if not name:
+            return None
+        url = self.storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
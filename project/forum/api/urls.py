@@ -1,34 +1,95 @@
 from django.urls import path
 
+from project.threadpool import read_view
 from .views import (
     ListTopicView,
+    TopicAutocompleteView,
     ListUserTopicsView,
+    ListModeratedTopicsView,
     EditTopicView,
     DeleteTopicView,
     CreateCommentView,
+    BulkCreateCommentView,
+    ModerateTopicsView,
+    ChangesView,
+    TopicChangesView,
+    ModerateCommentsView,
+    ExportTopicThreadView,
+    ExportUserActivityView,
     EditCommentView,
     DeleteCommentView,
     AttachModeratorView,
+    AssignModeratorView,
 )
 
 app_name = "forum"
 
 urlpatterns = [
-    path("topics/", ListTopicView.as_view(), name="list_create_topics"),
-    path("topics/my/", ListUserTopicsView.as_view(), name="list_create_own_topics"),
-    path("topics/<int:pk>/edit/", EditTopicView.as_view(), name="get_update_topic"),
+    path("topics/", read_view(ListTopicView.as_view()), name="list_create_topics"),
+    path(
+        "topics/autocomplete/",
+        read_view(TopicAutocompleteView.as_view()),
+        name="autocomplete_topics",
+    ),
+    path(
+        "topics/my/",
+        read_view(ListUserTopicsView.as_view()),
+        name="list_create_own_topics",
+    ),
+    path(
+        "topics/moderated/",
+        read_view(ListModeratedTopicsView.as_view()),
+        name="list_moderated_topics",
+    ),
+    path(
+        "topics/<int:pk>/edit/",
+        read_view(EditTopicView.as_view()),
+        name="get_update_topic",
+    ),
     path("topics/<int:pk>/delete/", DeleteTopicView.as_view(), name="delete_topic"),
     path(
         "topics/<int:topic>/comments/",
-        CreateCommentView.as_view(),
+        read_view(CreateCommentView.as_view()),
         name="create_comment",
     ),
-    path("topics/comment/<int:pk>/", EditCommentView.as_view(), name="edit_comment"),
+    path(
+        "topics/comments/bulk/",
+        BulkCreateCommentView.as_view(),
+        name="bulk_create_comments",
+    ),
+    path("topics/changes/", read_view(ChangesView.as_view()), name="changes"),
+    path(
+        "topics/<int:topic>/changes/",
+        read_view(TopicChangesView.as_view()),
+        name="topic_changes",
+    ),
+    path("topics/moderate/", ModerateTopicsView.as_view(), name="moderate_topics"),
+    path(
+        "topics/comments/moderate/",
+        ModerateCommentsView.as_view(),
+        name="moderate_comments",
+    ),
+    path(
+        "topics/<int:topic>/export/<str:export_format>/",
+        read_view(ExportTopicThreadView.as_view()),
+        name="export_topic_thread",
+    ),
+    path(
+        "topics/my/export/<str:export_format>/",
+        read_view(ExportUserActivityView.as_view()),
+        name="export_own_activity",
+    ),
+    path(
+        "topics/comment/<int:pk>/",
+        read_view(EditCommentView.as_view()),
+        name="edit_comment",
+    ),
     path(
         "topics/comment/<int:pk>/delete/",
         DeleteCommentView.as_view(),
         name="delete_comment",
     ),
     path("topics/<int:pk>/moderator/", AttachModeratorView.as_view(), name="attaching_moderator"),
+    path("topics/moderators/", AssignModeratorView.as_view(), name="assign_moderator"),
 
 ]
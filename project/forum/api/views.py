@@ -1,72 +1,288 @@
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.cache import cache_control
 
-from rest_framework import filters
-from rest_framework.exceptions import PermissionDenied
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.generics import (
+    ListAPIView,
     ListCreateAPIView,
     RetrieveUpdateAPIView,
     UpdateAPIView,
     DestroyAPIView,
 )
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import (
     AllowAny,
     IsAuthenticated,
     IsAdminUser,
     IsAuthenticatedOrReadOnly,
 )
-
-from forum.models import Comment, Topic
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from forum import cache as response_cache
+from forum.changes import InvalidCursor, decode_cursor, get_changes
+from forum.export import CONTENT_TYPES, export_response, iter_rows
+from forum.fragments import get_comment_fragments
+from forum.models import (
+    Comment,
+    Topic,
+    COMMENT_PREVIEW_SIZE,
+    COMMENT_PREVIEW_MAX_SIZE,
+)
+from project.caches import is_shared
+from .filters import TopicSearchFilter, TopicOrderingFilter
+from .pagination import (
+    CursorOrPageNumberMixin,
+    TopicCursorPagination,
+    CommentCursorPagination,
+)
 from .permissions import IsOwnerOrReadOnly, IsModeratorOrOwner
 from .serializer import (
     TopicSerializer,
     CommentSerializer,
+    BulkCommentSerializer,
     CommentEditSerializer,
     DeleteCommentSerializer,
     AttachModeratorSerializer,
+    ModeratorAssignmentSerializer,
+    TopicModerationSerializer,
+    CommentModerationSerializer,
+    CommentRowSerializer,
+    TopicRowSerializer,
 )
 
 
-class ListTopicView(ListCreateAPIView):
+class CommentPreviewMixin:
     """
-    List or create topics.
+    Embed the newest comments into topic payload.
+
+    Their number can be set by "?comments=" parameter
+    """
+
+    def get_preview_size(self):
+        try:
+            size = int(self.request.query_params.get("comments", COMMENT_PREVIEW_SIZE))
+        except (AttributeError, ValueError):
+            return COMMENT_PREVIEW_SIZE
+        return min(max(size, 0), COMMENT_PREVIEW_MAX_SIZE)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["preview_size"] = self.get_preview_size()
+        return context
+
+
+class AnonymousCacheMixin:
+    """
+    Serve list responses of anonymous users from cache.
+
+    Cached pages are dropped on any forum write, see forum.cache
+    """
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated or not settings.FORUM_RESPONSE_CACHE_TIMEOUT:
+            return super().list(request, *args, **kwargs)
+
+        key = response_cache.get_response_key(request)
+        data = response_cache.get_cached_response(key)
+        if data is not None:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set_cached_response(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class RowListMixin:
+    """
+    List endpoint output built from values() rows by row_serializer_class.
+
+    Output is the same as of serializer_class, which is used for writes
+    """
+
+    row_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.prefetch_related(None).values(*self.row_serializer_class.values)
+        serializer = self.row_serializer_class(self.get_serializer_context())
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.many(page))
+        return Response(serializer.many(rows))
+
+
+class ConditionalGetMixin:
+    """
+    Answer 304 Not Modified when client's copy is still current.
 
-    Possibility search the topics by title: just add "?search=" parameter at the end of the url
+    ETag and Last-Modified are taken from cheap queries before serialization
     """
 
-    queryset = Topic.objects.filter(is_active=True)
+    def get_validators(self):
+        """
+        Return values the response depends on and its last modified time,
+        or None when they can't be had cheaply
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        values, last_modified = validators
+        source = repr(
+            (request.get_full_path(), request.accepted_renderer.format, values)
+        )
+        etag = quote_etag(hashlib.md5(source.encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        return response
+
+
+def get_thread_state(topic):
+    """Number of comments of the topic and time of the last change of them"""
+    return Comment.objects.filter(topic=topic).aggregate(
+        count=Count("id"), updated=Max("updated")
+    )
+
+
+class ListTopicView(
+    ConditionalGetMixin,
+    AnonymousCacheMixin,
+    RowListMixin,
+    CursorOrPageNumberMixin,
+    CommentPreviewMixin,
+    ListCreateAPIView,
+):
+    """
+    List or create topics.
+
+    Possibility search the topics by title, description and comments: just add "?search=" parameter at the end of the url
+
+    Most active or recently active topics: add "?ordering=-comment_count" or "?ordering=-last_comment_at"
+    """
 
     serializer_class = TopicSerializer
+    row_serializer_class = TopicRowSerializer
     permission_classes = (IsOwnerOrReadOnly, IsAuthenticatedOrReadOnly)
+    pagination_class = TopicCursorPagination
 
-    filter_backends = [filters.SearchFilter]
-    search_fields = ["title"]
+    filter_backends = [TopicSearchFilter, TopicOrderingFilter]
+    ordering_fields = ["created", "comment_count", "last_comment_at"]
+    ordering = TopicCursorPagination.ordering
+    # Ranked search results and custom orderings are paginated by page numbers
+    page_number_params = ("page", "search", "ordering")
+
+    def get_queryset(self):
+        topics = Topic.objects.filter(is_active=True)
+        return topics.with_related(self.get_preview_size())
+
+    def get_validators(self):
+        # Any forum write changes the generation, see forum.cache. Other
+        # processes see it only in a shared cache, without one there is no
+        # cheap validator of the whole forum and conditional GET is skipped
+        if is_shared():
+            return response_cache.get_generation(), None
+        return None
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
-class ListUserTopicsView(ListCreateAPIView):
+class TopicAutocompleteView(APIView):
+    """
+    Suggest titles of topics while typing: just add "?q=" parameter at the end of the url
+
+    Returns only id and title of topics which titles start with the text
+    or contain a word similar to it
+    """
+
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    min_length = 2
+    cache_max_age = 60
+
+    @method_decorator(cache_control(public=True, max_age=cache_max_age))
+    def get(self, request):
+        text = request.query_params.get("q", "").strip()
+        if len(text) < self.min_length:
+            return Response([])
+
+        topics = Topic.objects.filter(is_active=True)
+        return Response(topics.autocomplete(text))
+
+
+class ListUserTopicsView(RowListMixin, CommentPreviewMixin, ListCreateAPIView):
     """Get only login user topics. Can create new topic"""
 
     serializer_class = TopicSerializer
+    row_serializer_class = TopicRowSerializer
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
         user = self.request.user
-        return Topic.objects.filter(author=user)
+        return Topic.objects.filter(author=user).with_related(self.get_preview_size())
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
-class EditTopicView(RetrieveUpdateAPIView):
+class ListModeratedTopicsView(RowListMixin, CommentPreviewMixin, ListAPIView):
+    """Get topics you are attached to as moderator"""
+
+    serializer_class = TopicSerializer
+    row_serializer_class = TopicRowSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        ids = Topic.objects.moderated_topic_ids(self.request.user)
+        return Topic.objects.filter(pk__in=ids).with_related(self.get_preview_size())
+
+
+class EditTopicView(ConditionalGetMixin, CommentPreviewMixin, RetrieveUpdateAPIView):
     """
     You can get and update topic if you are owner or moderator
     """
 
     serializer_class = TopicSerializer
     permission_classes = (IsModeratorOrOwner,)
-    queryset = Topic.objects.all()
+
+    def get_queryset(self):
+        return Topic.objects.with_related(self.get_preview_size())
+
+    def get_validators(self):
+        topic = get_object_or_404(
+            Topic.objects.only("updated", "author", "moderator"), pk=self.kwargs["pk"]
+        )
+        self.check_object_permissions(self.request, topic)
+
+        thread = get_thread_state(topic)
+        last_modified = max(filter(None, (topic.updated, thread["updated"])))
+        return (topic.updated, thread["count"], thread["updated"]), last_modified
 
 
 class DeleteTopicView(DestroyAPIView):
@@ -77,23 +293,313 @@ class DeleteTopicView(DestroyAPIView):
     queryset = Topic.objects.all()
 
 
-class CreateCommentView(ListCreateAPIView):
+class CreateCommentView(
+    ConditionalGetMixin, CursorOrPageNumberMixin, ListCreateAPIView
+):
     """List or create comments for the topic"""
 
     permission_classes = (IsAuthenticated,)
     serializer_class = CommentSerializer
+    pagination_class = CommentCursorPagination
 
     def get_queryset(self):
-        return Comment.objects.filter(topic=self.kwargs.get("topic"))
+        comments = Comment.objects.filter(topic=self.kwargs.get("topic"))
+        return comments.select_related("author").order_by("created", "id")
+
+    def get_validators(self):
+        thread = get_thread_state(self.kwargs.get("topic"))
+        return (thread["count"], thread["updated"]), thread["updated"]
+
+    def list(self, request, *args, **kwargs):
+        # Browsable API renders as usual
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, JSONRenderer):
+            return super().list(request, *args, **kwargs)
+
+        comments = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(comments.values(*CommentRowSerializer.values))
+        serializer = CommentRowSerializer(self.get_serializer_context())
+        fragments = get_comment_fragments(
+            rows, lambda row: renderer.render(serializer.to_representation(row))
+        )
+
+        # Splice rendered comments into the rendered page envelope
+        envelope = self.get_paginated_response([]).data
+        del envelope["results"]
+        body = renderer.render(envelope)[:-1]
+        body += b',"results":[' + b",".join(fragments) + b"]}"
+        return HttpResponse(body, content_type=renderer.media_type)
 
     def perform_create(self, serializer):
-        topic = get_object_or_404(Topic, pk=self.kwargs.get("topic"))
+        # Topic row stays locked until the comment is committed, so it can't be
+        # closed in between. Activity counters are updated in the same transaction
+        with transaction.atomic():
+            topic = get_object_or_404(
+                Topic.objects.select_for_update().only("id", "closed"),
+                pk=self.kwargs.get("topic"),
+            )
+
+            if topic.closed:
+                msg = "The topic is closed"
+                raise PermissionDenied(msg)
+
+            serializer.save(author=self.request.user, topic=topic)
+
+
+class BulkCreateCommentView(APIView):
+    """
+    Create many comments at once: send a list of {"content", "topic"} objects
+
+    Results are in the same order, invalid items get "errors" instead
+    of being created and don't fail the rest of the batch
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError("Expected a list of comments")
+        if len(items) > settings.FORUM_BULK_COMMENTS_MAX:
+            msg = f"At most {settings.FORUM_BULK_COMMENTS_MAX} comments at once"
+            raise ValidationError(msg)
+
+        batch = [BulkCommentSerializer(data=item) for item in items]
+        errors = {
+            index: serializer.errors
+            for index, serializer in enumerate(batch)
+            if not serializer.is_valid()
+        }
+
+        # Every topic of the batch is checked once. Topic rows stay locked, in
+        # id order, until the comments are committed, so none is closed between
+        with transaction.atomic():
+            topics = dict(
+                Topic.objects.select_for_update()
+                .filter(
+                    pk__in={
+                        serializer.validated_data["topic"]
+                        for index, serializer in enumerate(batch)
+                        if index not in errors
+                    }
+                )
+                .order_by("id")
+                .values_list("id", "closed")
+            )
+            comments = {}
+            for index, serializer in enumerate(batch):
+                if index in errors:
+                    continue
+                topic = serializer.validated_data["topic"]
+                if topic not in topics:
+                    errors[index] = {"topic": ["Topic not found"]}
+                elif topics[topic]:
+                    errors[index] = {"topic": ["The topic is closed"]}
+                else:
+                    comments[index] = Comment(
+                        topic_id=topic,
+                        author=request.user,
+                        content=serializer.validated_data["content"],
+                    )
+
+            if comments:
+                Comment.objects.bulk_add(list(comments.values()))
+
+        results = [
+            (
+                {"errors": errors[index]}
+                if index in errors
+                else CommentSerializer(comments[index]).data
+            )
+            for index in range(len(batch))
+        ]
+        return Response(
+            results,
+            status=status.HTTP_201_CREATED if comments else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class ChangesMixin:
+    """Change feed of topics and comments after "?since=" cursor"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_cursor(self):
+        since = self.request.query_params.get("since")
+        if not since:
+            return None
+        try:
+            return decode_cursor(since)
+        except InvalidCursor:
+            raise ValidationError({"since": ["Invalid cursor"]})
+
+    def get_changes_response(self, topics, comments):
+        topics, comments, cursor, more = get_changes(
+            topics.values(*TopicRowSerializer.values),
+            comments.values(*CommentRowSerializer.values),
+            self.get_cursor(),
+        )
+
+        serializer = TopicRowSerializer({"request": self.request})
+        topics = [serializer.to_representation(row) for row in topics]
+        for topic in topics:
+            # Comments come in the same feed
+            del topic["comments"]
+
+        return Response(
+            {
+                "cursor": cursor,
+                "more": more,
+                "topics": topics,
+                "comments": serializer.comments.many(comments),
+            }
+        )
+
+
+class ChangesView(ChangesMixin, APIView):
+    """
+    Topics and comments created, updated or deleted after "?since=" cursor
+
+    Start without cursor and pass "cursor" of the response next time,
+    "more" tells that the next page of changes is ready already. Inactive
+    topics are listed only to their author and moderator
+    """
+
+    def get(self, request):
+        topics = Topic.objects.visible_to(request.user)
+        return self.get_changes_response(
+            topics, Comment.objects.filter(topic__in=topics.values("id"))
+        )
+
+
+class TopicChangesView(ChangesMixin, APIView):
+    """Changes of the topic and its comments, the same way as for all topics"""
+
+    def get(self, request, topic):
+        topic = get_object_or_404(
+            Topic.objects.visible_to(request.user).only("id"), pk=topic
+        )
+        return self.get_changes_response(
+            Topic.objects.filter(pk=topic.pk), Comment.objects.filter(topic=topic)
+        )
+
+
+class ModerateTopicsView(APIView):
+    """
+    Close or hide many topics at once: send {"ids": [...], "action": "close"}
+    or "deactivate" as action
 
-        if topic.closed:
-            msg = "The topic is closed"
-            raise PermissionDenied(msg)
+    Only topics you own or moderate are changed, returns how many of them
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = TopicModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        topics = Topic.objects.moderated_by(request.user).filter(
+            pk__in=serializer.validated_data["ids"]
+        )
+        if serializer.validated_data["action"] == "close":
+            updated = topics.close()
+        else:
+            updated = topics.deactivate()
+        return Response({"updated": updated})
+
+
+class ModerateCommentsView(APIView):
+    """
+    Delete many comments at once: send {"ids": [...]} or {"author": username}
+    to delete all comments of the user
+
+    Only your comments in open topics and comments in topics you own
+    or moderate are deleted, returns how many of them
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = CommentModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        comments = Comment.objects.moderated_by(request.user)
+        if "ids" in serializer.validated_data:
+            comments = comments.filter(pk__in=serializer.validated_data["ids"])
+        if "author" in serializer.validated_data:
+            comments = comments.filter(author=serializer.validated_data["author"])
+        return Response({"deleted": comments.soft_delete()})
 
-        serializer.save(author=self.request.user, topic=topic)
+
+class ExportMixin:
+    """Stream whole export as NDJSON or CSV, format comes from the url"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def perform_content_negotiation(self, request, force=False):
+        # Export isn't rendered, so "Accept: text/csv" is fine as well
+        return super().perform_content_negotiation(request, force=True)
+
+    def get_export_format(self):
+        export_format = self.kwargs["export_format"]
+        if export_format not in CONTENT_TYPES:
+            raise Http404
+        return export_format
+
+
+class ExportTopicThreadView(ExportMixin, APIView):
+    """Export all comments of the topic in order they were left"""
+
+    def get(self, request, topic, export_format):
+        export_format = self.get_export_format()
+        topic = get_object_or_404(
+            Topic.objects.visible_to(request.user).only("id"), pk=topic
+        )
+
+        comments = (
+            Comment.objects.filter(topic=topic)
+            .order_by("created", "id")
+            .values(*CommentRowSerializer.values)
+        )
+        serializer = CommentRowSerializer()
+        rows = iter_rows([comments], serializer.to_representation)
+        return export_response(
+            rows, CommentSerializer.Meta.fields, export_format, f"topic-{topic.pk}"
+        )
+
+
+class ExportUserActivityView(ExportMixin, APIView):
+    """Export topics and comments of login user, every row has its "type" """
+
+    fields = ("type", "id", "topic", "title", "content", "status", "created", "updated")
+    topic_values = ("id", "title", "description", "created", "updated", "closed")
+
+    def get(self, request, export_format):
+        export_format = self.get_export_format()
+        serializer = CommentRowSerializer()
+        date = serializer.datetime.to_representation
+
+        def serialize(row):
+            if "title" in row:
+                row = dict(row, type="topic")
+            else:
+                row = dict(serializer.to_representation(row), type="comment")
+            row["created"] = date(row["created"])
+            row["updated"] = date(row["updated"])
+            return row
+
+        topics = Topic.objects.filter(author=request.user).order_by("created", "id")
+        comments = Comment.objects.filter(author=request.user).order_by("created", "id")
+        rows = iter_rows(
+            [
+                topics.values(*self.topic_values),
+                comments.values(*CommentRowSerializer.values),
+            ],
+            serialize,
+        )
+        return export_response(
+            rows, self.fields, export_format, f"{request.user.username}-activity"
+        )
 
 
 class EditCommentView(RetrieveUpdateAPIView):
@@ -122,3 +628,21 @@ class AttachModeratorView(UpdateAPIView):
     permission_classes = (IsAdminUser,)
     serializer_class = AttachModeratorSerializer
     queryset = Topic.objects.all()
+
+
+class AssignModeratorView(APIView):
+    """
+    Attach user to many topics as moderator: send {"ids": [...], "moderator": username}
+
+    Returns how many topics were changed
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def post(self, request):
+        serializer = ModeratorAssignmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        topics = Topic.objects.filter(pk__in=serializer.validated_data["ids"])
+        updated = topics.assign_moderator(serializer.validated_data["moderator"])
+        return Response({"updated": updated})
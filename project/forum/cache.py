@@ -0,0 +1,97 @@
+"""
+Response cache of anonymous topic listing and other cached forum data.
+
+Generation is bumped in the cache of the process which made the write,
+so every process of a deployment must use the same shared cache
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Every forum write bumps generation, so cached responses of previous
+# generations are never served again and just expire
+GENERATION_KEY = "forum:generation"
+HITS_KEY = "forum:response:hits"
+MODERATED_TOPICS_KEY = "forum:moderated:{}"
+MISSES_KEY = "forum:response:misses"
+
+
+def get_generation():
+    # Start from current time so generation doesn't repeat after eviction
+    cache.add(GENERATION_KEY, time.time_ns(), None)
+    return cache.get(GENERATION_KEY)
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def get_response_key(request):
+    """
+    Key of the response in current generation.
+
+    Take it before running queries, so data which is cached under it
+    is never older than the generation. Scheme and host are part of the key,
+    as cached data holds absolute urls
+    """
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"forum:response:{get_generation()}:{url}"
+
+
+def get_cached_response(key):
+    data = cache.get(key)
+    # Counting costs two more cache round trips per request
+    if settings.FORUM_RESPONSE_CACHE_STATS:
+        _count(HITS_KEY if data is not None else MISSES_KEY)
+    return data
+
+
+def set_cached_response(key, data):
+    cache.set(key, data, settings.FORUM_RESPONSE_CACHE_TIMEOUT)
+
+
+def get_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {"hits": hits, "misses": misses}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_moderated_topics(user_id):
+    """Cached ids of topics the user moderates or None"""
+    return cache.get(MODERATED_TOPICS_KEY.format(user_id))
+
+
+def set_moderated_topics(user_id, ids):
+    cache.set(
+        MODERATED_TOPICS_KEY.format(user_id),
+        ids,
+        settings.FORUM_MODERATED_TOPICS_TIMEOUT,
+    )
+
+
+def invalidate_moderated_topics(user_ids):
+    keys = [MODERATED_TOPICS_KEY.format(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    # Again on commit: concurrent readers could cache not yet committed state
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,82 @@
+import base64
+import binascii
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+# Topics and comments changed at the same time are listed topics first
+TOPIC = 0
+COMMENT = 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(updated, kind, pk):
+    value = f"{updated.isoformat()}|{kind}|{pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(updated, kind, pk) of the last listed change"""
+    try:
+        updated, kind, pk = base64.urlsafe_b64decode(cursor).decode().split("|")
+        updated = datetime.fromisoformat(updated)
+        kind, pk = int(kind), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if timezone.is_naive(updated) or kind not in (TOPIC, COMMENT):
+        raise InvalidCursor(cursor)
+    return updated, kind, pk
+
+
+def _changed_after(cursor, kind):
+    if cursor is None:
+        return Q()
+    updated, cursor_kind, pk = cursor
+    after = Q(updated__gt=updated)
+    if kind > cursor_kind:
+        after |= Q(updated=updated)
+    elif kind == cursor_kind:
+        after |= Q(updated=updated, id__gt=pk)
+    return after
+
+
+def get_changes(topics, comments, cursor=None, limit=None, settle_seconds=None):
+    """
+    Topic and comment values() rows changed after the cursor, oldest first.
+
+    Returns (topics, comments, next cursor, whether more changes are left),
+    next cursor is None only if nothing was ever changed
+    """
+    limit = limit or settings.FORUM_CHANGES_LIMIT
+    if settle_seconds is None:
+        settle_seconds = settings.FORUM_CHANGES_SETTLE_SECONDS
+    until = timezone.now() - timedelta(seconds=settle_seconds)
+
+    changes = []
+    for kind, rows in ((TOPIC, topics), (COMMENT, comments)):
+        rows = rows.filter(_changed_after(cursor, kind), updated__lte=until)
+        rows = rows.order_by("updated", "id")[: limit + 1]
+        changes += [(row["updated"], kind, row["id"], row) for row in rows]
+
+    changes.sort(key=lambda change: change[:3])
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    if changes:
+        next_cursor = encode_cursor(*changes[-1][:3])
+    elif cursor is not None:
+        next_cursor = encode_cursor(*cursor)
+    else:
+        next_cursor = None
+
+    return (
+        [row for _, kind, _, row in changes if kind == TOPIC],
+        [row for _, kind, _, row in changes if kind == COMMENT],
+        next_cursor,
+        more,
+    )
@@ -0,0 +1,33 @@
+import json
+
+from django.conf import settings
+from django.db import connections
+
+
+def notify(payloads, using="default"):
+    """
+    Send payloads to comment streams of all processes, see forum.streams
+
+    NOTIFY is delivered when the transaction commits, so streams never
+    see changes that are rolled back
+    """
+    if not payloads:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+            [settings.FORUM_STREAM_CHANNEL, [json.dumps(p) for p in payloads]],
+        )
+
+
+def notify_comments(comments, using="default"):
+    """Comments were created, edited or deleted"""
+    notify(
+        [{"topic": comment.topic_id, "comment": comment.pk} for comment in comments],
+        using,
+    )
+
+
+def notify_topics(topics, using="default"):
+    """Comments of topics were changed in bulk, streams should resync"""
+    notify([{"topic": topic} for topic in topics], using)
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_rows(querysets, serialize, chunk_size=None):
+    """
+    Serialized rows of querysets one after another.
+
+    Rows are read from server-side cursor, so only one chunk is in memory
+    """
+    chunk_size = chunk_size or settings.FORUM_EXPORT_CHUNK_SIZE
+    for queryset in querysets:
+        for row in queryset.iterator(chunk_size=chunk_size):
+            yield serialize(row)
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_ndjson(items, chunk_size=None):
+    """JSON object per line, one chunk of bytes per batch of items"""
+    chunk_size = chunk_size or settings.FORUM_EXPORT_CHUNK_SIZE
+    for batch in _batched(items, chunk_size):
+        yield "".join(json.dumps(item) + "\n" for item in batch).encode()
+
+
+def stream_csv(items, fields, chunk_size=None):
+    """CSV with header, one chunk of bytes per batch of items"""
+    chunk_size = chunk_size or settings.FORUM_EXPORT_CHUNK_SIZE
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields, restval="", extrasaction="ignore")
+    writer.writeheader()
+    for batch in _batched(items, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_response(items, fields, export_format, filename):
+    """Streaming response of items in "ndjson" or "csv" format"""
+    if export_format == "csv":
+        content = stream_csv(items, fields)
+    else:
+        content = stream_ndjson(items)
+
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+    response["Content-Disposition"] = (
+        f'attachment; filename="{filename}.{export_format}"'
+    )
+    return response
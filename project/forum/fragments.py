@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class LRUFragments:
+    """
+    In-process cache of rendered fragments limited by their total size.
+
+    Least recently used fragments are evicted first
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, version):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, version, fragment):
+        if len(fragment) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._items[key] = (version, fragment)
+            self.size += len(fragment)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+
+local_fragments = LRUFragments(settings.FORUM_COMMENT_FRAGMENTS_MAX_BYTES)
+
+
+def _version(updated):
+    return updated.isoformat()
+
+
+def _shared_key(comment_id, version):
+    return f"forum:comment:{comment_id}:{version}"
+
+
+def get_comment_fragments(rows, render):
+    """
+    Rendered JSON of comment rows in the same order.
+
+    Fragments are looked up in process memory, then in shared cache,
+    missing ones are rendered by render(row) and stored in both
+    """
+    fragments = {}
+    missing = {}
+    for row in rows:
+        version = _version(row["updated"])
+        fragment = local_fragments.get(row["id"], version)
+        if fragment is None:
+            missing[_shared_key(row["id"], version)] = (row, version)
+        else:
+            fragments[row["id"]] = fragment
+
+    if missing:
+        shared = cache.get_many(missing)
+        rendered = {}
+        for key, (row, version) in missing.items():
+            fragment = shared.get(key)
+            if fragment is None:
+                fragment = rendered[key] = render(row)
+            local_fragments.set(row["id"], version, fragment)
+            fragments[row["id"]] = fragment
+        if rendered:
+            cache.set_many(rendered, settings.FORUM_COMMENT_FRAGMENTS_TIMEOUT)
+
+    return [fragments[row["id"]] for row in rows]
+
+
+def invalidate_comment(comment):
+    """Drop fragments of the comment, call it before the comment is changed"""
+    local_fragments.delete(comment.pk)
+    if comment.updated is not None:
+        cache.delete(_shared_key(comment.pk, _version(comment.updated)))
@@ -0,0 +1,73 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from django.core.handlers import asgi
+
+from project.threadpool import run_in_pool
+
+_END = object()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGI handler which iterates streaming responses in the pool.
+
+    Django 3.1 iterates them in the event loop thread, where streaming
+    exports can't read from the database
+    """
+
+    # Chunks produced ahead of a slow client
+    streaming_buffer = 2
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append(
+                (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+
+        # Whole response is iterated by one thread, server-side cursors
+        # are bound to the connection of the thread
+        loop = asyncio.get_event_loop()
+        parts = asyncio.Queue(self.streaming_buffer)
+
+        def put(part):
+            asyncio.run_coroutine_threadsafe(parts.put(part), loop).result()
+
+        def produce():
+            try:
+                for part in response:
+                    put(part)
+            finally:
+                put(_END)
+
+        producer = asyncio.ensure_future(run_in_pool(produce))
+        while True:
+            part = await parts.get()
+            if part is _END:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await producer
+        await send({"type": "http.response.body"})
+        # Closes connections of the thread which ran the view, as Django does
+        await sync_to_async(response.close, thread_sensitive=True)()
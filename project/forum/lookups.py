@@ -0,0 +1,46 @@
+from django.db import models
+from django.db.models.lookups import PostgresOperatorLookup
+
+
+@models.CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    Field contains a word similar to the value (pg_trgm "%>" operator).
+
+    Uses trigram index, threshold is pg_trgm.word_similarity_threshold
+    """
+
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
+
+
+@models.CharField.register_lookup
+class IPrefix(models.Lookup):
+    """
+    Field starts with the value ignoring case, by "ILIKE 'value%'".
+
+    Unlike istartswith, which compares UPPER() of the field,
+    it's served by trigram index of the field
+    """
+
+    lookup_name = "iprefix"
+
+    def get_db_prep_lookup(self, value, connection):
+        return "%s", [connection.ops.prep_for_like_query(value) + "%"]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} ILIKE {rhs}", lhs_params + rhs_params
+
+
+class TrigramWordSimilarity(models.Func):
+    """Greatest similarity between the string and a word of the expression"""
+
+    function = "WORD_SIMILARITY"
+    output_field = models.FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, "resolve_expression"):
+            string = models.Value(string)
+        super().__init__(string, expression, **extra)
@@ -0,0 +1,353 @@
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+import accounts.api.urls
+import forum.api.urls
+from accounts.models import UserProfile
+from forum.cache import bump_generation
+from forum.models import Comment, Topic
+
+User = get_user_model()
+
+
+def scenario(name, method="get", kwargs=None, data=None, status=200, **options):
+    label = f"{method.upper()} {name}"
+    if options.get("anonymous"):
+        label += " (anonymous)"
+    return dict(
+        options,
+        label=label,
+        name=name,
+        method=method,
+        kwargs=kwargs or {},
+        data=data,
+        status=status,
+    )
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles, queries and bytes out of every forum "
+        "and accounts endpoint on generated data, optionally compared to "
+        "a baseline: fails when an endpoint makes more queries, or its "
+        "median latency or response size grows more than the tolerance"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Users created")
+        parser.add_argument("--topics", type=int, default=10, help="Topics per user")
+        parser.add_argument(
+            "--comments", type=int, default=20, help="Comments per topic"
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Requests per endpoint"
+        )
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--output", help="Write JSON report to this file")
+        parser.add_argument("--baseline", help="JSON report to compare with")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the report to --baseline instead of comparing",
+        )
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.5,
+            help="Allowed growth of median latency, 0.5 is 50%%",
+        )
+        parser.add_argument(
+            "--bytes-tolerance",
+            type=float,
+            default=0.1,
+            help="Allowed growth of response size",
+        )
+
+    def handle(self, *args, **options):
+        if settings.FORUM_ASYNC_VIEWS:
+            raise CommandError(
+                "Async views query in other connections, turn FORUM_ASYNC_VIEWS off"
+            )
+        if options["users"] < 2 or options["topics"] < 1 or options["comments"] < 1:
+            raise CommandError("At least 2 users, 1 topic and 1 comment are needed")
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline needs --baseline")
+
+        # Data of the benchmark is rolled back afterwards
+        try:
+            with transaction.atomic():
+                fixtures = self.create_fixtures(options)
+                scenarios = self.get_scenarios(fixtures)
+                self.check_coverage(scenarios)
+                endpoints = {
+                    item["label"]: self.measure(item, fixtures, options)
+                    for item in scenarios
+                }
+                transaction.set_rollback(True)
+        finally:
+            # Cached responses may contain rolled back topics
+            bump_generation()
+
+        report = {
+            "fixtures": {key: options[key] for key in ("users", "topics", "comments")},
+            "requests": options["requests"],
+            "endpoints": endpoints,
+        }
+        content = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(content + "\n")
+        else:
+            self.stdout.write(content)
+
+        if options["save_baseline"]:
+            with open(options["baseline"], "w") as file:
+                file.write(content + "\n")
+        elif options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            if baseline["fixtures"] != report["fixtures"]:
+                raise CommandError(
+                    f"Baseline was measured with other fixtures: {baseline['fixtures']}"
+                )
+            regressions = self.compare(endpoints, baseline["endpoints"], options)
+            if regressions:
+                raise CommandError(
+                    f"{len(regressions)} regressions against baseline:\n"
+                    + "\n".join(regressions)
+                )
+
+    def create_fixtures(self, options):
+        """Users, each with topics, each with comments by all users in turn"""
+        suffix = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create(
+            User(
+                username=f"benchmark_{suffix}_{number}",
+                email=f"benchmark_{suffix}_{number}@example.com",
+                is_staff=number == 0,
+            )
+            for number in range(options["users"])
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+
+        # Requests are sent by the first user, who moderates every other topic
+        actor = users[0]
+        topics = Topic.objects.bulk_create(
+            Topic(
+                author=user,
+                moderator=actor if number % 2 else None,
+                title=f"Benchmark topic {number} of {user.username}",
+                description="Benchmark topic " * 20,
+                is_active=True,
+            )
+            for user in users
+            for number in range(options["topics"])
+        )
+        comments = Comment.objects.bulk_add(
+            [
+                Comment(
+                    topic=topic,
+                    author=users[number % len(users)],
+                    content=f"Benchmark comment {number}",
+                )
+                for topic in topics
+                for number in range(options["comments"])
+            ]
+        )
+
+        own_topics = [topic for topic in topics if topic.author_id == actor.pk]
+        topic = own_topics[0]
+        return {
+            "actor": actor,
+            "other": users[1],
+            "topic": topic,
+            "own_topics": [topic.pk for topic in own_topics],
+            "comment": next(c for c in comments if c.author_id == actor.pk),
+            "topic_comments": [c.pk for c in comments if c.topic_id == topic.pk],
+        }
+
+    def get_scenarios(self, fixtures):
+        actor, other = fixtures["actor"], fixtures["other"]
+        topic = {"pk": fixtures["topic"].pk}
+        thread = {"topic": fixtures["topic"].pk}
+        comment = {"pk": fixtures["comment"].pk}
+        profile = {"username": actor.username}
+        return [
+            scenario("forum:list_create_topics", anonymous=True),
+            scenario("forum:list_create_topics"),
+            scenario(
+                "forum:list_create_topics",
+                "post",
+                data={"title": "Benchmark", "description": "Benchmark topic"},
+                status=201,
+            ),
+            scenario("forum:autocomplete_topics", data={"q": "Benchmark"}),
+            scenario("forum:list_create_own_topics"),
+            scenario("forum:list_moderated_topics"),
+            scenario("forum:get_update_topic", kwargs=topic),
+            scenario(
+                "forum:get_update_topic", "patch", topic, {"title": "Edited topic"}
+            ),
+            scenario("forum:delete_topic", "delete", topic, status=204),
+            scenario("forum:create_comment", kwargs=thread),
+            scenario(
+                "forum:create_comment",
+                "post",
+                thread,
+                {"content": "Benchmark comment"},
+                status=201,
+            ),
+            scenario(
+                "forum:bulk_create_comments",
+                "post",
+                data=[
+                    {"content": f"Bulk comment {number}", "topic": thread["topic"]}
+                    for number in range(10)
+                ],
+                status=201,
+            ),
+            scenario("forum:changes"),
+            scenario("forum:topic_changes", kwargs=thread),
+            scenario(
+                "forum:moderate_topics",
+                "post",
+                data={"ids": fixtures["own_topics"], "action": "close"},
+            ),
+            scenario(
+                "forum:moderate_comments",
+                "post",
+                data={"ids": fixtures["topic_comments"]},
+            ),
+            scenario(
+                "forum:export_topic_thread", kwargs=dict(thread, export_format="csv")
+            ),
+            scenario("forum:export_own_activity", kwargs={"export_format": "ndjson"}),
+            scenario("forum:edit_comment", kwargs=comment),
+            scenario(
+                "forum:edit_comment", "put", comment, {"content": "Edited comment"}
+            ),
+            scenario("forum:delete_comment", "put", comment, {}),
+            scenario(
+                "forum:attaching_moderator", "put", topic, {"moderator": other.pk}
+            ),
+            scenario(
+                "forum:assign_moderator",
+                "post",
+                data={"ids": fixtures["own_topics"], "moderator": other.username},
+            ),
+            scenario(
+                "accounts:create_user",
+                "post",
+                data={
+                    "username": f"{actor.username}_new",
+                    "email": f"new_{actor.email}",
+                    "password": "Benchmark-password-1",
+                    "profile": {"name": "Benchmark", "about": "Benchmark user"},
+                },
+                status=201,
+            ),
+            scenario("accounts:update_user_profile", kwargs=profile),
+            scenario(
+                "accounts:update_user_profile",
+                "put",
+                profile,
+                {
+                    "current_password": "",
+                    "new_password": "",
+                    "email": actor.email,
+                    "profile": {"name": "Edited", "about": "Edited about"},
+                },
+            ),
+        ]
+
+    def check_coverage(self, scenarios):
+        names = {
+            f"{module.app_name}:{pattern.name}"
+            for module in (forum.api.urls, accounts.api.urls)
+            for pattern in module.urlpatterns
+        }
+        missing = names - {item["name"] for item in scenarios}
+        if missing:
+            raise CommandError(
+                f"No benchmark for endpoints: {', '.join(sorted(missing))}"
+            )
+
+    def measure(self, item, fixtures, options):
+        client = APIClient(SERVER_NAME=options["host"])
+        if not item.get("anonymous"):
+            client.force_login(fixtures["actor"])
+        url = reverse(item["name"], kwargs=item["kwargs"])
+        send = getattr(client, item["method"])
+
+        timings = []
+        queries = []
+        sizes = []
+        # Warm up, so caches are measured when they are filled
+        for number in range(options["requests"] + 1):
+            # Every request sees the same data, writes are rolled back
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    if item["method"] == "get":
+                        response = send(url, item["data"])
+                    else:
+                        response = send(url, item["data"], format="json")
+                    if response.streaming:
+                        size = sum(map(len, response.streaming_content))
+                    else:
+                        size = len(response.content)
+                    elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+
+            if response.status_code != item["status"]:
+                raise CommandError(
+                    f"{item['label']}: expected status {item['status']}, "
+                    f"got {response.status_code}"
+                )
+            if number:
+                timings.append(elapsed * 1000)
+                queries.append(len(context.captured_queries))
+                sizes.append(size)
+
+        timings.sort()
+        return {
+            "p50": round(percentile(timings, 0.5), 3),
+            "p90": round(percentile(timings, 0.9), 3),
+            "p99": round(percentile(timings, 0.99), 3),
+            "queries": max(queries),
+            "bytes": max(sizes),
+        }
+
+    def compare(self, endpoints, baseline, options):
+        regressions = []
+        for label, result in endpoints.items():
+            before = baseline.get(label)
+            if before is None:
+                continue
+            if result["queries"] > before["queries"]:
+                regressions.append(
+                    f"{label}: {before['queries']} -> {result['queries']} queries"
+                )
+            if result["p50"] > before["p50"] * (1 + options["latency_tolerance"]):
+                regressions.append(
+                    f"{label}: median {before['p50']} -> {result['p50']} ms"
+                )
+            if result["bytes"] > before["bytes"] * (1 + options["bytes_tolerance"]):
+                regressions.append(
+                    f"{label}: {before['bytes']} -> {result['bytes']} bytes"
+                )
+        return regressions
@@ -0,0 +1,73 @@
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.views import static
+
+from project.media import serve_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure throughput of full and range GETs of a large media file "
+        "served by project.media and django.views.static"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=64, help="File size in MB")
+        parser.add_argument(
+            "--requests", type=int, default=20, help="Requests per measurement"
+        )
+        parser.add_argument(
+            "--range-size", type=int, default=1024, help="KB read by a range GET"
+        )
+
+    def handle(self, *args, **options):
+        size = options["size"] * 1024 * 1024
+        name = f"benchmark_{uuid.uuid4().hex[:8]}.bin"
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        with open(path, "wb") as file:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(options["size"]):
+                file.write(chunk)
+
+        def serve_static(request, path):
+            return static.serve(request, path, document_root=settings.MEDIA_ROOT)
+
+        range_size = min(options["range_size"] * 1024, size)
+        try:
+            self.measure("django.views.static", serve_static, name, options)
+            self.measure("project.media", serve_media, name, options)
+            self.measure("project.media", serve_media, name, options, range_size)
+        finally:
+            os.remove(path)
+
+    def measure(self, label, view, name, options, range_size=None):
+        factory = RequestFactory()
+        size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, name))
+        received = 0
+        statuses = set()
+        start = time.perf_counter()
+        for number in range(options["requests"]):
+            headers = {}
+            if range_size:
+                # Ranges spread over the file
+                first = number * range_size % (size - range_size + 1)
+                headers["HTTP_RANGE"] = f"bytes={first}-{first + range_size - 1}"
+            response = view(factory.get(f"/media/{name}", **headers), name)
+            for data in response:
+                received += len(data)
+            response.close()
+            statuses.add(str(response.status_code))
+        elapsed = time.perf_counter() - start
+
+        kind = "range" if range_size else "full"
+        self.stdout.write(
+            f"{label:<20} {kind:<5}: {received / elapsed / 1024 / 1024:>9.1f} MB/s, "
+            f"{elapsed / options['requests'] * 1000:>8.2f} ms per request, "
+            f"status {', '.join(sorted(statuses))}"
+        )
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.test import APIRequestFactory
+
+from forum.api.serializer import TopicSerializer, TopicRowSerializer
+from forum.models import Topic
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows per second of TopicSerializer and TopicRowSerializer "
+        "on the topic list page"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=100, help="Topics serialized per round"
+        )
+        parser.add_argument(
+            "--rounds", type=int, default=20, help="Rounds of each serializer"
+        )
+
+    def handle(self, *args, **options):
+        request = APIRequestFactory().get("/", SERVER_NAME="localhost")
+        context = {"request": request}
+        ids = list(
+            Topic.objects.filter(is_active=True)
+            .order_by("-created", "-id")
+            .values_list("id", flat=True)[: options["rows"]]
+        )
+        if not ids:
+            raise CommandError("Database has no active topics, seed it first")
+
+        def serialize_models():
+            topics = list(Topic.objects.with_related().filter(pk__in=ids))
+            return TopicSerializer(topics, many=True, context=context).data
+
+        def serialize_rows():
+            rows = Topic.objects.filter(pk__in=ids).values(*TopicRowSerializer.values)
+            return TopicRowSerializer(context).many(rows)
+
+        for name, func in (
+            ("TopicSerializer", serialize_models),
+            ("TopicRowSerializer", serialize_rows),
+        ):
+            rows = 0
+            start = time.perf_counter()
+            for _ in range(options["rounds"]):
+                rows += len(func())
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{name}: {rows / elapsed:.0f} rows/sec "
+                f"({elapsed / options['rounds'] * 1000:.2f} ms per round)"
+            )
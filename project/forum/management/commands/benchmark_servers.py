@@ -0,0 +1,192 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from forum.handlers import ASGIHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests/sec and latency of an endpoint served by WSGI "
+        "and ASGI handlers at increasing concurrency. Response cache is off, "
+        "so anonymous GETs reach the views unless --response-cache is given"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/api/v1/topics/", help="GET this url")
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 8, 32, 64],
+            help="Requests in flight at once",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Requests per concurrency level"
+        )
+        parser.add_argument(
+            "--mode",
+            choices=("wsgi", "asgi"),
+            help="Run only this mode in this process, "
+            "otherwise both run in subprocesses with async views off and on",
+        )
+        parser.add_argument(
+            "--response-cache",
+            action="store_true",
+            help="Serve anonymous GETs from the response cache, measuring cache hits",
+        )
+        parser.add_argument("--json", action="store_true", help="Print JSON lines")
+
+    def handle(self, *args, **options):
+        if options["mode"] is None:
+            results = self.run_subprocesses(options)
+        elif options["response_cache"]:
+            results = self.measure_all(options)
+        else:
+            with override_settings(FORUM_RESPONSE_CACHE_TIMEOUT=0):
+                results = self.measure_all(options)
+
+        for result in results:
+            if options["json"]:
+                self.stdout.write(json.dumps(result))
+            else:
+                self.stdout.write(
+                    "{mode:<18} concurrency {concurrency:>4}: {rps:>8.1f} req/s, "
+                    "p50 {p50:>7.2f} ms, p99 {p99:>7.2f} ms, errors {errors}".format(
+                        **result
+                    )
+                )
+
+    def run_subprocesses(self, options):
+        manage = os.path.join(settings.BASE_DIR, "manage.py")
+        results = []
+        for mode, async_views in (("wsgi", "0"), ("asgi", "1")):
+            command = [
+                sys.executable,
+                manage,
+                "benchmark_servers",
+                "--mode",
+                mode,
+                "--json",
+                "--path",
+                options["path"],
+                "--host",
+                options["host"],
+                "--requests",
+                str(options["requests"]),
+                "--concurrency",
+                *map(str, options["concurrency"]),
+            ]
+            if options["response_cache"]:
+                command.append("--response-cache")
+            env = dict(os.environ, FORUM_ASYNC_VIEWS=async_views)
+            process = subprocess.run(command, env=env, capture_output=True, text=True)
+            if process.returncode:
+                raise CommandError(process.stderr)
+            results += [json.loads(line) for line in process.stdout.splitlines()]
+        return results
+
+    def measure_all(self, options):
+        return [
+            self.measure(options, concurrency) for concurrency in options["concurrency"]
+        ]
+
+    def measure(self, options, concurrency):
+        if options["mode"] == "wsgi":
+            mode = "wsgi"
+            started, timings = self.run_wsgi(options, concurrency)
+        else:
+            mode = "asgi (async views)" if settings.FORUM_ASYNC_VIEWS else "asgi"
+            started, timings = asyncio.run(self.run_asgi(options, concurrency))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _ in timings)
+        return {
+            "mode": mode,
+            "concurrency": concurrency,
+            "rps": len(timings) / elapsed,
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+            "errors": sum(1 for _, status in timings if status != 200),
+        }
+
+    def run_wsgi(self, options, concurrency):
+        """Handler called by a pool of threads, as threaded WSGI servers do"""
+        handler = WSGIHandler()
+        url = urlsplit(options["path"])
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": url.path,
+            "QUERY_STRING": url.query,
+            "SERVER_NAME": options["host"],
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+
+        def request(_):
+            statuses = []
+            start = time.perf_counter()
+            response = handler(
+                dict(environ, **{"wsgi.input": io.BytesIO()}),
+                lambda status, headers, exc_info=None: statuses.append(status),
+            )
+            for _ in response:
+                pass
+            response.close()
+            return time.perf_counter() - start, int(statuses[0].split()[0])
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            started = time.perf_counter()
+            return started, list(pool.map(request, range(options["requests"])))
+
+    async def run_asgi(self, options, concurrency):
+        """Handler called by concurrent tasks of one event loop, as ASGI servers do"""
+        handler = ASGIHandler()
+        url = urlsplit(options["path"])
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "path": url.path,
+            "query_string": url.query.encode(),
+            "headers": [(b"host", options["host"].encode())],
+            "server": (options["host"], 80),
+        }
+        pending = iter(range(options["requests"]))
+        timings = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def worker():
+            for _ in pending:
+                statuses = []
+
+                async def send(message):
+                    if message["type"] == "http.response.start":
+                        statuses.append(message["status"])
+
+                start = time.perf_counter()
+                await handler(dict(scope), receive, send)
+                timings.append((time.perf_counter() - start, statuses[0]))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return started, timings
@@ -0,0 +1,172 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve, reverse
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from forum.models import Topic, Comment
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN ANALYZE on queries of forum endpoints "
+        "and flag sequential scans on large tables"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-rows",
+            type=int,
+            default=10000,
+            help="Sequential scan is flagged for tables with at least this many rows",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Update planner statistics of forum tables first, e.g. after seeding",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print full plan of every query",
+        )
+
+    def handle(self, *args, **options):
+        if options["analyze"]:
+            with connection.cursor() as cursor:
+                for model in (Topic, Comment, User):
+                    cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+        topic = (
+            Topic.objects.filter(is_active=True)
+            .order_by("-comment_count")
+            .select_related("author")
+            .first()
+        )
+        if topic is None:
+            raise CommandError("Database has no active topics, seed it first")
+
+        author = (
+            Topic.objects.values("author")
+            .annotate(topics=Count("id"))
+            .order_by("-topics")
+            .values_list("author", flat=True)
+            .first()
+        )
+        author = User.objects.get(pk=author)
+        word = topic.title.split()[0]
+
+        list_url = reverse("forum:list_create_topics")
+        endpoints = [
+            ("topics", list_url, {}, None),
+            ("topics: search", list_url, {"search": word}, None),
+            ("topics: most active", list_url, {"ordering": "-comment_count"}, None),
+            (
+                "topics: recently active",
+                list_url,
+                {"ordering": "-last_comment_at"},
+                None,
+            ),
+            (
+                "topics: autocomplete",
+                reverse("forum:autocomplete_topics"),
+                {"q": word[:4]},
+                None,
+            ),
+            ("own topics", reverse("forum:list_create_own_topics"), {}, author),
+            ("changes", reverse("forum:changes"), {}, author),
+            (
+                "topic changes",
+                reverse("forum:topic_changes", kwargs={"topic": topic.pk}),
+                {},
+                author,
+            ),
+            (
+                "topic",
+                reverse("forum:get_update_topic", kwargs={"pk": topic.pk}),
+                {},
+                topic.author,
+            ),
+            (
+                "comments",
+                reverse("forum:create_comment", kwargs={"topic": topic.pk}),
+                {},
+                topic.author,
+            ),
+        ]
+
+        table_rows = self.get_table_rows()
+        flagged = []
+        for name, url, params, user in endpoints:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: GET {url}"))
+            for sql in self.capture_queries(url, params, user):
+                plan = self.explain(sql)
+                scans = list(self.seq_scans(plan["Plan"]))
+                self.stdout.write(f"  {plan['Execution Time']:.2f} ms  {sql[:100]}")
+                if options["verbose_plans"]:
+                    self.stdout.write(json.dumps(plan, indent=2))
+
+                for table in scans:
+                    rows = table_rows.get(table, 0)
+                    if rows >= options["min_rows"]:
+                        message = f"  Seq Scan on {table} ({rows} rows)"
+                        self.stdout.write(self.style.ERROR(message))
+                        flagged.append(f"{name}: {table}")
+
+        if flagged:
+            raise CommandError(
+                "Sequential scans on large tables: " + ", ".join(flagged)
+            )
+        self.stdout.write(self.style.SUCCESS("No sequential scans on large tables"))
+
+    def capture_queries(self, url, params, user):
+        """Call the view and return SELECT queries it has run"""
+        request = APIRequestFactory().get(url, params, SERVER_NAME="localhost")
+        if user is not None:
+            force_authenticate(request, user=user)
+        match = resolve(url)
+
+        # Cached responses of anonymous requests would run no queries
+        with override_settings(FORUM_RESPONSE_CACHE_TIMEOUT=0):
+            with CaptureQueriesContext(connection) as context:
+                response = match.func(request, *match.args, **match.kwargs)
+                # Comment list is spliced from rendered fragments already
+                if hasattr(response, "render"):
+                    response.render()
+
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} returned {response.status_code}")
+        return [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].lstrip().upper().startswith("SELECT")
+        ]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql)
+            result = cursor.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]
+
+    def seq_scans(self, node):
+        """Tables read by sequential scan anywhere in the plan"""
+        if node["Node Type"] == "Seq Scan":
+            yield node["Relation Name"]
+        for child in node.get("Plans", []):
+            yield from self.seq_scans(child)
+
+    def get_table_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r'"
+            )
+            return dict(cursor.fetchall())
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models.functions import Now
+
+from accounts.models import UserProfile
+from forum.cache import bump_generation
+from forum.models import Topic
+from project.images import process_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Strip metadata of uploaded topic images and avatars, limit their size "
+        "and create resized and WebP variants"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=20, help="Images processed at once"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait when no images are waiting",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no images are waiting"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Topic changes, so cached responses with old image are dropped
+            topics = process_pending(Topic, options["batch_size"], updated=Now())
+            if topics:
+                bump_generation()
+            avatars = process_pending(UserProfile, options["batch_size"])
+
+            if topics or avatars:
+                self.stdout.write(f"Processed {topics} images and {avatars} avatars")
+                continue
+            if options["once"]:
+                return
+            close_old_connections()
+            time.sleep(options["interval"])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from forum import cache as response_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Show hit and miss counts of cached topic list responses, "
+        "counted while FORUM_RESPONSE_CACHE_STATS is on"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset counters after showing"
+        )
+
+    def handle(self, *args, **options):
+        stats = response_cache.get_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, "
+            f"hit ratio: {ratio:.1%}"
+        )
+        if options["reset"]:
+            response_cache.reset_stats()
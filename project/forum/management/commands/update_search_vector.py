@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Comment, Topic
+
+
+class Command(BaseCommand):
+    help = "Rebuild full-text search vectors of topics and comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows updated by one query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in (Topic, Comment):
+            ids = list(model.objects.order_by("pk").values_list("pk", flat=True))
+
+            updated = 0
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start : start + batch_size]
+                updated += model.objects.filter(pk__in=batch).update_search_vector()
+
+            name = model._meta.verbose_name_plural
+            self.stdout.write(self.style.SUCCESS(f"Updated {updated} {name}"))
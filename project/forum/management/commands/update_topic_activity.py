@@ -0,0 +1,50 @@
+from django.db.models import F, Q
+from django.core.management.base import BaseCommand
+
+from forum.models import Topic
+
+
+def is_distinct(field, other):
+    """Q for SQL "field IS DISTINCT FROM other" """
+    return (
+        Q(**{f"{field}__isnull": False, f"{other}__isnull": False})
+        & ~Q(**{field: F(other)})
+        | Q(**{f"{field}__isnull": True, f"{other}__isnull": False})
+        | Q(**{f"{field}__isnull": False, f"{other}__isnull": True})
+    )
+
+
+class Command(BaseCommand):
+    help = "Reconcile topics' comment count and last activity with comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of topics updated by one query",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild counters of all topics, not only mismatched ones",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        topics = Topic.objects.order_by("pk")
+        if not options["all"]:
+            topics = topics.with_actual_activity().filter(
+                is_distinct("comment_count", "actual_comment_count")
+                | is_distinct("last_comment_at", "actual_last_comment_at")
+                | is_distinct("last_comment_author", "actual_last_comment_author")
+            )
+        ids = list(topics.values_list("pk", flat=True))
+
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            updated += Topic.objects.filter(pk__in=batch).update_activity()
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} topics"))
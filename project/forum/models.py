@@ -1,7 +1,29 @@
-from django.db import models
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Now
+from django.db.models.signals import post_delete, post_save, post_migrate, pre_migrate
+from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+)
 
 from accounts.models import UserProfile
+from project.images import ProcessedImageMixin, validate_image_size
+from .cache import (
+    bump_generation,
+    get_moderated_topics,
+    invalidate_moderated_topics,
+    set_moderated_topics,
+)
+from .events import notify_comments, notify_topics
+from .fragments import invalidate_comment
+from .lookups import TrigramWordSimilarity
 
 User = get_user_model()
 
@@ -12,7 +34,340 @@ COMMENT_STATUS_OPTIONS = (
 )
 
 
-class Topic(models.Model):
+# Topic fields which are maintained in db by UPDATE queries
+UPDATED_IN_DB_FIELDS = (
+    "comment_count",
+    "last_comment_at",
+    "last_comment_author_id",
+    "search_vector",
+)
+
+# How many of the newest comments are embedded into topic payload by default
+COMMENT_PREVIEW_SIZE = 3
+COMMENT_PREVIEW_MAX_SIZE = 20
+
+
+class TopicQuerySet(models.QuerySet):
+    def with_related(self, preview_size=COMMENT_PREVIEW_SIZE):
+        """
+        Load authors, moderators and the newest comments
+        with a fixed number of queries
+        """
+        preview = (
+            Comment.objects.newest_per_topic(preview_size)
+            .select_related("author")
+            .defer("search_vector")
+        )
+        return (
+            self.select_related("author", "moderator", "last_comment_author")
+            .defer("search_vector")
+            .prefetch_related(
+                models.Prefetch(
+                    "comment_set", queryset=preview, to_attr="comment_preview"
+                )
+            )
+        )
+
+    def search(self, text):
+        """
+        Full-text search by title, description and comments ranked by relevance.
+
+        Topics and comments have own vectors, matching ids of both GIN indexes
+        are united, the best matching comment adds to the rank of its topic
+        """
+        query = SearchQuery(
+            text, config=settings.FORUM_SEARCH_CONFIG, search_type="websearch"
+        )
+        matching = Topic.objects.filter(search_vector=query).order_by().values("id")
+        matching = matching.union(
+            Comment.objects.filter(search_vector=query).order_by().values("topic")
+        )
+        comment_rank = (
+            Comment.objects.filter(topic=models.OuterRef("pk"), search_vector=query)
+            .order_by()
+            .values("topic")
+            .annotate(rank=models.Max(SearchRank(models.F("search_vector"), query)))
+            .values("rank")
+        )
+        topic_rank = Coalesce(
+            SearchRank(models.F("search_vector"), query), models.Value(0.0)
+        )
+        return (
+            self.filter(pk__in=matching)
+            .annotate(
+                rank=topic_rank
+                + Coalesce(models.Subquery(comment_rank), models.Value(0.0))
+            )
+            .order_by("-rank", "-created", "-id")
+        )
+
+    def update_search_vector(self):
+        """Rebuild stored search vector of title and description in a single UPDATE"""
+        vector = SearchVector(
+            "title", weight="A", config=settings.FORUM_SEARCH_CONFIG
+        ) + SearchVector("description", weight="B", config=settings.FORUM_SEARCH_CONFIG)
+        return self.update(search_vector=vector)
+
+    def add_comment(self, comment):
+        """Count new comment and move last activity forward in a single UPDATE"""
+        is_newer = models.Q(last_comment_at__isnull=True) | models.Q(
+            last_comment_at__lt=comment.created
+        )
+        return self.update(
+            comment_count=models.F("comment_count") + 1,
+            last_comment_at=models.Case(
+                models.When(is_newer, then=models.Value(comment.created)),
+                default=models.F("last_comment_at"),
+            ),
+            last_comment_author=models.Case(
+                models.When(is_newer, then=models.Value(comment.author_id)),
+                default=models.F("last_comment_author"),
+            ),
+        )
+
+    def remove_comment(self):
+        """Uncount deleted comment and take last activity from remaining ones"""
+        last = self._last_comments()
+        return self.update(
+            comment_count=models.F("comment_count") - 1,
+            last_comment_at=models.Subquery(last.values("created")[:1]),
+            last_comment_author=models.Subquery(last.values("author")[:1]),
+        )
+
+    def update_activity(self):
+        """Recount comments and last activity of topics from Comment table"""
+        last = self._last_comments()
+        return self.update(
+            comment_count=Coalesce(models.Subquery(self._count_comments()), 0),
+            last_comment_at=models.Subquery(last.values("created")[:1]),
+            last_comment_author=models.Subquery(last.values("author")[:1]),
+        )
+
+    def with_actual_activity(self):
+        """Annotate comment count and last activity computed from Comment table"""
+        last = self._last_comments()
+        return self.annotate(
+            actual_comment_count=Coalesce(models.Subquery(self._count_comments()), 0),
+            actual_last_comment_at=models.Subquery(last.values("created")[:1]),
+            actual_last_comment_author=models.Subquery(last.values("author")[:1]),
+        )
+
+    def _last_comments(self):
+        return (
+            Comment.objects.filter(topic=models.OuterRef("pk"))
+            .exclude(status="deleted")
+            .order_by("-created", "-id")
+        )
+
+    def _count_comments(self):
+        return (
+            Comment.objects.filter(topic=models.OuterRef("pk"))
+            .exclude(status="deleted")
+            .order_by()
+            .values("topic")
+            .annotate(count=models.Count("id"))
+            .values("count")
+        )
+
+    def moderated_by(self, user):
+        """Topics the user may moderate: own, moderated by them or any for staff"""
+        if user.is_staff:
+            return self
+        return self.filter(models.Q(author=user) | models.Q(moderator=user))
+
+    def visible_to(self, user):
+        """Active topics and inactive ones the user may moderate"""
+        if user.is_staff:
+            return self
+        return self.filter(
+            models.Q(is_active=True) | models.Q(author=user) | models.Q(moderator=user)
+        )
+
+    def close(self):
+        """Close open topics in a single UPDATE, returns how many were closed"""
+        return self._moderate(closed=True)
+
+    def deactivate(self):
+        """Hide active topics in a single UPDATE, returns how many were hidden"""
+        return self._moderate(is_active=False)
+
+    def _moderate(self, **values):
+        changed = self.exclude(**values).update(updated=Now(), **values)
+        if changed:
+            bump_generation()
+            transaction.on_commit(bump_generation, using=self.db)
+        return changed
+
+    def assign_moderator(self, user):
+        """
+        Attach the user as moderator to the topics in one transaction.
+
+        Cached topic ids of the user and of replaced moderators are dropped,
+        returns how many topics were changed
+        """
+        with transaction.atomic(using=self.db):
+            topics = list(
+                self.exclude(moderator=user)
+                .select_for_update()
+                .values_list("id", "moderator")
+            )
+            if not topics:
+                return 0
+            Topic.objects.filter(pk__in=[pk for pk, _ in topics]).update(
+                moderator=user, updated=Now()
+            )
+            UserProfile.objects.filter(user=user, is_moderator=False).update(
+                is_moderator=True
+            )
+
+            replaced = {moderator for _, moderator in topics if moderator is not None}
+            invalidate_moderated_topics({user.pk} | replaced)
+            bump_generation()
+            transaction.on_commit(bump_generation, using=self.db)
+        return len(topics)
+
+    def moderated_topic_ids(self, user):
+        """Ids of topics the user is attached to as moderator, cached per user"""
+        ids = get_moderated_topics(user.pk)
+        if ids is None:
+            ids = list(
+                Topic.objects.filter(moderator=user).values_list("id", flat=True)
+            )
+            set_moderated_topics(user.pk, ids)
+        return ids
+
+    def autocomplete(self, text, limit=None, threshold=None):
+        """
+        Titles starting with text or containing a word similar to it.
+
+        Evaluated right away because trigram threshold is set for the transaction
+        """
+        if limit is None:
+            limit = settings.FORUM_AUTOCOMPLETE_LIMIT
+        if threshold is None:
+            threshold = settings.FORUM_AUTOCOMPLETE_THRESHOLD
+
+        topics = (
+            self.filter(
+                models.Q(title__iprefix=text)
+                | models.Q(title__trigram_word_similar=text)
+            )
+            .annotate(
+                prefix=models.Case(
+                    models.When(title__iprefix=text, then=True),
+                    default=False,
+                    output_field=models.BooleanField(),
+                ),
+                similarity=TrigramWordSimilarity(text, "title"),
+            )
+            .order_by("-prefix", "-similarity", "title")
+            .values("id", "title")[:limit]
+        )
+
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(
+                    "SET LOCAL pg_trgm.word_similarity_threshold = %s", [threshold]
+                )
+            return list(topics)
+
+
+def comment_search_vector(content):
+    return SearchVector(content, weight="C", config=settings.FORUM_SEARCH_CONFIG)
+
+
+class CommentQuerySet(models.QuerySet):
+    def newest_per_topic(self, size):
+        """Only the newest comments of every topic, newest first"""
+        newest = (
+            Comment.objects.filter(topic=models.OuterRef("topic"))
+            .order_by("-created", "-id")
+            .values("id")[:size]
+        )
+        return self.filter(id__in=models.Subquery(newest)).order_by("-created", "-id")
+
+    def moderated_by(self, user):
+        """
+        Own comments in open topics, comments in topics the user moderates
+        or any for staff
+        """
+        if user.is_staff:
+            return self
+        return self.filter(
+            models.Q(author=user, topic__closed=False)
+            | models.Q(topic__author=user)
+            | models.Q(topic__moderator=user)
+        )
+
+    def update_search_vector(self):
+        """
+        Rebuild stored search vector of comments in a single UPDATE.
+
+        Every comment has own vector, so a write costs the same in any thread
+        and no topic's vector grows with its thread. Deleted ones have none
+        """
+        vector = models.Case(
+            models.When(status="deleted", then=models.Value(None)),
+            default=comment_search_vector("content"),
+            output_field=SearchVectorField(),
+        )
+        return self.update(search_vector=vector)
+
+    def soft_delete(self):
+        """
+        Same as Comment.delete_comment for all comments with one UPDATE.
+
+        Counters of their topics are updated once,
+        returns how many comments were deleted
+        """
+        with transaction.atomic(using=self.db):
+            # Rows are locked and updated by id, so comments added meanwhile
+            # aren't deleted without their topics being updated
+            rows = list(
+                self.exclude(status="deleted")
+                .select_for_update(of=("self",))
+                .values_list("id", "topic")
+            )
+            topics = {topic for _, topic in rows}
+            deleted = self.model.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+                content="Comment was deleted",
+                status="deleted",
+                updated=Now(),
+                search_vector=None,
+            )
+            if deleted:
+                notify_topics(topics, using=self.db)
+                Topic.objects.filter(pk__in=topics).update_activity()
+
+        # Cached fragments are versioned by "updated", so they aren't served again
+        if deleted:
+            bump_generation()
+            transaction.on_commit(bump_generation, using=self.db)
+        return deleted
+
+    def bulk_add(self, comments):
+        """
+        Insert comments with one query.
+
+        bulk_create doesn't send post_save, so search vectors of comments
+        and counters of their topics are updated here once per batch
+        """
+        with transaction.atomic(using=self.db):
+            comments = self.bulk_create(comments)
+            ids = [comment.pk for comment in comments]
+            self.filter(pk__in=ids).update_search_vector()
+            topics = Topic.objects.filter(
+                pk__in={comment.topic_id for comment in comments}
+            )
+            topics.update_activity()
+            notify_comments(comments, using=self.db)
+
+        bump_generation()
+        transaction.on_commit(bump_generation, using=self.db)
+        return comments
+
+
+class Topic(ProcessedImageMixin, models.Model):
     """Model for user's topic on forum"""
 
     author = models.ForeignKey(
@@ -27,23 +382,95 @@ class Topic(models.Model):
     )
     title = models.CharField(max_length=120)
     description = models.TextField(blank=True, null=True)
-    image = models.ImageField(null=True, blank=True)
+    image = models.ImageField(null=True, blank=True, validators=[validate_image_size])
+    # Processed files of the image, see project.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     closed = models.BooleanField(default=False)
     is_active = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # Activity counters, maintained by TopicQuerySet.add_comment/remove_comment
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_comment_author = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="topic_last_comment_author",
+        blank=True,
+        null=True,
+        editable=False,
+    )
+
+    # Kept up to date by signals below, see TopicQuerySet.update_search_vector
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = TopicQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            GinIndex(
+                name="forum_topic_title_trgm",
+                fields=["title"],
+                opclasses=["gin_trgm_ops"],
+            ),
+            # Topic list, newest first
+            models.Index(
+                name="forum_topic_active_created",
+                fields=["-created", "-id"],
+                condition=models.Q(is_active=True),
+            ),
+            # "Most active" ordering, see also create_last_comment_at_index
+            models.Index(
+                name="forum_topic_active_comments",
+                fields=["-comment_count", "-id"],
+                condition=models.Q(is_active=True),
+            ),
+            # User's own topics, newest first
+            models.Index(
+                name="forum_topic_author_created",
+                fields=["author", "-created", "-id"],
+            ),
+            # Change feed
+            models.Index(name="forum_topic_updated", fields=["updated", "id"]),
+            # Images waiting for process_images command
+            models.Index(
+                name="forum_topic_image_pending",
+                fields=["id"],
+                condition=models.Q(image__gt="", image_variants={}),
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Counters and search vector are changed by UPDATE queries only,
+        # saving loaded instance mustn't overwrite them with stale values
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            skip = set(self.get_deferred_fields()) | set(UPDATED_IN_DB_FIELDS)
+            skip |= self.get_image_skip_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skip
+            ]
+        super().save(*args, **kwargs)
+        self.image_saved()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Cached topics of the previous moderator are dropped on change
+        instance._loaded_moderator_id = instance.__dict__.get("moderator_id")
+        return instance
+
     def set_user_as_moderator(self, user):
-        user_profile = UserProfile.objects.get(user=user)
-        user_profile.set_user_as_moderator()
+        Topic.objects.filter(pk=self.pk).assign_moderator(user)
         self.moderator = user
-        self.save()
+        self._loaded_moderator_id = user.pk
 
 
 class Comment(models.Model):
@@ -63,15 +490,172 @@ class Comment(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # Kept up to date by signals below, see CommentQuerySet.update_search_vector
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(name="forum_comment_search", fields=["search_vector"]),
+            # Topic's thread in order comments were left
+            models.Index(
+                name="forum_comment_topic_created",
+                fields=["topic", "created", "id"],
+            ),
+            # Change feed, of all topics and of one topic
+            models.Index(name="forum_comment_updated", fields=["updated", "id"]),
+            models.Index(
+                name="forum_comment_topic_updated",
+                fields=["topic", "updated", "id"],
+            ),
+        ]
+
     def __str__(self):
         return self.content
 
     def update_comment(self):
-        self.status = "updated"
-        self.save()
+        """
+        Save new content if the topic is still open.
+
+        Returns False and changes nothing if the topic is closed
+        or the comment is deleted, deleted ones aren't counted in the topic
+        """
+        return self._update_if_open(
+            ~models.Q(status="deleted"), content=self.content, status="updated"
+        )
 
     def delete_comment(self):
-        """Don't delete comment from bd. Only change content and status"""
-        self.content = "Comment was deleted"
-        self.status = "deleted"
-        self.save()
+        """
+        Don't delete comment from bd. Only change content and status.
+
+        Returns False and changes nothing if the topic is closed
+        """
+        with transaction.atomic():
+            deleted = self._update_if_open(
+                ~models.Q(status="deleted"),
+                content="Comment was deleted",
+                status="deleted",
+            )
+            if deleted:
+                Topic.objects.filter(pk=self.topic_id).remove_comment()
+
+        if not deleted:
+            # Comment deleted already is fine, closed topic is not
+            return Comment.objects.filter(pk=self.pk, status="deleted").exists()
+        return True
+
+    def _update_if_open(self, *conditions, **values):
+        """
+        Write values by one UPDATE guarded by the topic being open in SQL.
+
+        Search vector is written by the same UPDATE, from the new content.
+        Sends post_save the same way as save(update_fields=...) does
+        """
+        invalidate_comment(self)
+        values["updated"] = timezone.now()
+        is_open = models.Exists(
+            Topic.objects.filter(pk=models.OuterRef("topic"), closed=False).values("id")
+        )
+        if values.get("status") == "deleted":
+            vector = None
+        else:
+            content = models.Value(values["content"], output_field=models.TextField())
+            vector = comment_search_vector(content)
+        comments = Comment.objects.filter(is_open, *conditions, pk=self.pk)
+        if not comments.update(search_vector=vector, **values):
+            return False
+
+        for field, value in values.items():
+            setattr(self, field, value)
+        post_save.send(
+            sender=Comment,
+            instance=self,
+            created=False,
+            update_fields=frozenset(values) | {"search_vector"},
+            raw=False,
+            using=comments.db,
+        )
+        return True
+
+
+# Trigram index on Topic.title requires pg_trgm extension
+@receiver(pre_migrate, dispatch_uid="forum_pg_trgm_extension")
+def create_trigram_extension(sender, using, *args, **kwargs):
+    if sender.label != "forum":
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+# "Recently active" ordering puts topics without comments last,
+# Index in Meta can't set NULLS LAST
+@receiver(post_migrate, dispatch_uid="forum_last_comment_at_index")
+def create_last_comment_at_index(sender, using, *args, **kwargs):
+    if sender.label != "forum":
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if Topic._meta.db_table not in connection.introspection.table_names(cursor):
+            return
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS forum_topic_active_last_comment "
+            "ON forum_topic (last_comment_at DESC NULLS LAST, id DESC) "
+            "WHERE is_active"
+        )
+
+
+# Keep topic's search vector current on writes
+@receiver(post_save, sender=Topic)
+def update_topic_search_vector(sender, instance, *args, **kwargs):
+    Topic.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_search_vector(sender, instance, update_fields, *args, **kwargs):
+    # Written already by Comment._update_if_open
+    if update_fields and "search_vector" in update_fields:
+        return
+    Comment.objects.filter(pk=instance.pk).update_search_vector()
+
+
+# Keep topic's activity counters current on new comments
+@receiver(post_save, sender=Comment)
+def update_comment_topic_activity(sender, instance, created, *args, **kwargs):
+    if created:
+        Topic.objects.filter(pk=instance.topic_id).add_comment(instance)
+
+
+# Push new, edited and deleted comments to comment streams
+@receiver(post_save, sender=Comment)
+def notify_comment_streams(sender, instance, using, *args, **kwargs):
+    notify_comments([instance], using=using)
+
+
+# Topic saved with other moderator, e.g. in admin
+@receiver(post_save, sender=Topic)
+def invalidate_topic_moderators(sender, instance, *args, **kwargs):
+    # Deferred moderator wasn't saved
+    if "moderator_id" not in instance.__dict__:
+        return
+    loaded = getattr(instance, "_loaded_moderator_id", None)
+    if instance.moderator_id != loaded:
+        invalidate_moderated_topics({instance.moderator_id, loaded} - {None})
+        instance._loaded_moderator_id = instance.moderator_id
+
+
+@receiver(post_delete, sender=Topic)
+def invalidate_deleted_topic_moderator(sender, instance, *args, **kwargs):
+    if instance.__dict__.get("moderator_id") is not None:
+        invalidate_moderated_topics([instance.moderator_id])
+
+
+# Cached responses of the previous generation mustn't be served after a write
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_response_cache_generation(sender, *args, **kwargs):
+    # Again on commit: concurrent readers could cache not yet committed state
+    bump_generation()
+    transaction.on_commit(bump_generation)
@@ -0,0 +1,323 @@
+import asyncio
+import io
+import json
+import re
+from collections import defaultdict
+from importlib import import_module
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, quote_ident
+
+from django.conf import settings
+from django.contrib import auth
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connections
+from django.utils.functional import SimpleLazyObject
+
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from forum.api.serializer import CommentRowSerializer
+from forum.changes import (
+    COMMENT,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    get_changes,
+)
+from forum.models import Comment, Topic
+from project.threadpool import database_sync_to_async, run_in_pool
+
+STREAM_PATH = re.compile(r"^/api/v1/topics/(?P<topic>\d+)/comments/stream/$")
+
+# Put instead of events of a client which doesn't keep up, see Subscription
+OVERFLOW = None
+
+
+def format_event(event, data, event_id=None):
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message.encode()
+
+
+def format_comment(row, serializer):
+    cursor = encode_cursor(row["updated"], COMMENT, row["id"])
+    return format_event(row["status"], serializer.to_representation(row), cursor)
+
+
+class Subscription:
+    """
+    Events for one stream, at most FORUM_STREAM_QUEUE_SIZE of them.
+
+    When the client is too slow, its events are dropped and the stream
+    is closed, the client reconnects and replays them from the change feed
+    """
+
+    def __init__(self, topic, size):
+        self.topic = topic
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def put(self, message):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class CommentListener:
+    """
+    LISTEN connection of the process, fans NOTIFY out to subscribed streams.
+
+    Every notified comment is read and rendered once however many
+    streams of its topic are open
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.serializer = CommentRowSerializer()
+        self._connection = None
+        self._notifies = None
+        self._dispatcher = None
+        # Created in the running loop, serializes starts of concurrent streams
+        self._start_lock = None
+
+    async def subscribe(self, topic):
+        if self._connection is None:
+            if self._start_lock is None:
+                self._start_lock = asyncio.Lock()
+            async with self._start_lock:
+                if self._connection is None:
+                    await self._start()
+        subscription = Subscription(topic, settings.FORUM_STREAM_QUEUE_SIZE)
+        self.subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get(subscription.topic, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self.subscriptions.pop(subscription.topic, None)
+
+    async def _start(self):
+        params = connections["default"].get_connection_params()
+        connection = await run_in_pool(psycopg2.connect, **params)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            channel = quote_ident(settings.FORUM_STREAM_CHANNEL, connection)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {channel}")
+        except psycopg2.Error:
+            connection.close()
+            raise
+
+        self._connection = connection
+        self._notifies = asyncio.Queue()
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+        asyncio.get_event_loop().add_reader(connection.fileno(), self._read)
+
+    def close(self):
+        """Stop listening, open streams are closed and clients reconnect"""
+        if self._connection is None:
+            return
+        asyncio.get_event_loop().remove_reader(self._connection.fileno())
+        self._dispatcher.cancel()
+        self._connection.close()
+        self._connection = None
+
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.put(OVERFLOW)
+        self.subscriptions.clear()
+
+    def _read(self):
+        try:
+            self._connection.poll()
+        except psycopg2.Error:
+            self.close()
+            return
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self._notifies.put_nowait(json.loads(notify.payload))
+
+    async def _dispatch(self):
+        while True:
+            payloads = [await self._notifies.get()]
+            while not self._notifies.empty():
+                payloads.append(self._notifies.get_nowait())
+
+            # Comments are read in their current state, so one event is enough
+            payloads = {
+                json.dumps(p, sort_keys=True): p
+                for p in payloads
+                if p["topic"] in self.subscriptions
+            }.values()
+            ids = [p["comment"] for p in payloads if "comment" in p]
+            try:
+                rows = await self._get_rows(ids) if ids else {}
+            except DatabaseError:
+                # Clients can still sync from the change feed later
+                rows = None
+
+            for payload in payloads:
+                if "comment" in payload and rows is not None:
+                    row = rows.get(payload["comment"])
+                    if row is None:
+                        continue
+                    message = format_comment(row, self.serializer)
+                else:
+                    message = format_event("changed", {"topic": payload["topic"]})
+                subscriptions = self.subscriptions.get(payload["topic"], ())
+                for subscription in list(subscriptions):
+                    subscription.put(message)
+                    if subscription.overflowed:
+                        self.unsubscribe(subscription)
+
+    @database_sync_to_async
+    def _get_rows(self, ids):
+        comments = Comment.objects.filter(pk__in=ids)
+        return {row["id"]: row for row in comments.values(*CommentRowSerializer.values)}
+
+
+class CommentStreamApplication:
+    """
+    ASGI application serving server-sent events of a topic's comments.
+
+    Events are "created", "updated" and "deleted" with the comment as data
+    and "changed" when comments were changed in bulk and should be synced
+    from the change feed. Other requests are passed to the Django application
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.listener = CommentListener()
+
+    async def __call__(self, scope, receive, send):
+        match = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = STREAM_PATH.match(scope["path"])
+        if match is None:
+            return await self.application(scope, receive, send)
+
+        topic = int(match.group("topic"))
+        error, since = await self.check_request(scope, topic)
+        if error is not None:
+            return await self.send_error(send, error)
+
+        # Subscribe before replay, so changes made meanwhile aren't missed
+        subscription = await self.listener.subscribe(topic)
+        try:
+            await self.stream(subscription, since, receive, send)
+        finally:
+            self.listener.unsubscribe(subscription)
+
+    @database_sync_to_async
+    def check_request(self, scope, topic):
+        """Error to respond with and the replay cursor from "Last-Event-ID" header"""
+        request = ASGIRequest(scope, io.BytesIO())
+        engine = import_module(settings.SESSION_ENGINE)
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        request.session = engine.SessionStore(session_key)
+        request.user = SimpleLazyObject(lambda: auth.get_user(request))
+
+        # The same authentication as of API views
+        authenticators = [
+            authenticator()
+            for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ]
+        try:
+            user = Request(request, authenticators=authenticators).user
+        except APIException as exc:
+            return exc, None
+        if not user.is_authenticated:
+            return NotAuthenticated(), None
+        # Inactive topics are streamed and replayed only to their author
+        # and moderator, as in the change feed
+        if not Topic.objects.visible_to(user).filter(pk=topic).exists():
+            return NotFound(), None
+
+        try:
+            since = decode_cursor(request.headers["Last-Event-ID"])
+        except (KeyError, InvalidCursor):
+            since = None
+        return None, since
+
+    @database_sync_to_async
+    def get_replay(self, topic, since):
+        """Messages of comments changed after the cursor"""
+        comments = Comment.objects.filter(topic=topic)
+        _, rows, _, more = get_changes(
+            Topic.objects.none().values("id", "updated"),
+            comments.values(*CommentRowSerializer.values),
+            since,
+            settle_seconds=0,
+        )
+        messages = [format_comment(row, self.listener.serializer) for row in rows]
+        if more:
+            messages.append(format_event("changed", {"topic": topic}))
+        return messages
+
+    async def stream(self, subscription, since, receive, send):
+        # Request body of GET is empty, only disconnect is expected afterwards
+        await receive()
+        disconnected = asyncio.ensure_future(receive())
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        body = b"retry: 1000\n\n"
+        if since is not None:
+            body += b"".join(await self.get_replay(subscription.topic, since))
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+        try:
+            while True:
+                message = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {message, disconnected},
+                    timeout=settings.FORUM_STREAM_HEARTBEAT_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected in done:
+                    message.cancel()
+                    return
+                if message not in done:
+                    message.cancel()
+                    body = b": heartbeat\n\n"
+                elif message.result() is OVERFLOW:
+                    break
+                else:
+                    body = message.result()
+                await send(
+                    {"type": "http.response.body", "body": body, "more_body": True}
+                )
+        finally:
+            disconnected.cancel()
+
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send_error(self, send, error):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": error.status_code,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        body = json.dumps({"detail": str(error.detail)}).encode()
+        await send({"type": "http.response.body", "body": body})
@@ -1,3 +1,2046 @@
-from django.test import TestCase
+import csv
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+import psycopg2
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import (
+    APIClient,
+    APIRequestFactory,
+    APITestCase,
+    APITransactionTestCase,
+)
+
+from accounts.models import UserProfile
+from project.db.base import DatabaseWrapper
+from project.threadpool import database_sync_to_async, read_view
+from project.workers import default_threads
+from . import cache as response_cache
+from .api import urls as forum_urls
+from .api.permissions import IsModeratorOrOwner
+from .api.serializer import CommentSerializer, TopicSerializer
+from .changes import COMMENT, encode_cursor
+from .fragments import LRUFragments, local_fragments
+from .api.pagination import TopicCursorPagination, CommentCursorPagination
+from .models import Topic, Comment
+from .streams import (
+    OVERFLOW,
+    CommentListener,
+    CommentStreamApplication,
+    Subscription,
+)
+from .api.views import ListTopicView
+from .handlers import ASGIHandler
+
+User = get_user_model()
+
+
+class QueryBudgetMixin:
+    """Fail the test when the block runs more queries than declared"""
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = "\n".join(query["sql"] for query in context.captured_queries)
+            self.fail(f"{executed} queries executed, budget is {budget}\n{queries}")
+        return result
+
+
+def create_topics(author, topics=3, comments=3, **kwargs):
+    """Create active topics with comments from several users"""
+    users = [
+        User.objects.create_user(f"{author.username}_{i}", f"{i}@gmail.com", "password")
+        for i in range(comments)
+    ]
+    created = []
+    for i in range(topics):
+        topic = Topic.objects.create(
+            author=author, moderator=users[0], title=f"Topic {i}", **kwargs
+        )
+        for user in users:
+            Comment.objects.create(topic=topic, author=user, content="comment")
+        created.append(topic)
+    return created
+
+
+class TestTopicQueryBudget(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+
+        self.test_user = User.objects.create_user(
+            self.username,
+            "test@gmail.com",
+            self.password,
+        )
+        UserProfile.objects.create(user=self.test_user)
+
+        self.auth_client = APIClient()
+        self.client_is_authorized = self.auth_client.login(
+            username=self.username,
+            password=self.password,
+        )
+
+    def test_list_topics_query_budget(self):
+        """Ensure topic list doesn't issue queries per topic or comment"""
+
+        create_topics(self.test_user, topics=10, comments=5, is_active=True)
+        url = reverse("forum:list_create_topics")
+
+        # topics with users, comments with authors, ETag from shared cache
+        with mock.patch("forum.api.views.is_shared", return_value=True):
+            response = self.assertQueryBudget(2, self.client.get, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(response.data["results"][0]["comment_count"], 5)
+
+    def test_list_user_topics_query_budget(self):
+        """Ensure own topic list doesn't issue queries per topic or comment"""
+
+        create_topics(self.test_user, topics=10, comments=5)
+        url = reverse("forum:list_create_own_topics")
+
+        # session, user, count, topics with users, comments with authors
+        response = self.assertQueryBudget(5, self.auth_client.get, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 10)
+
+    def test_get_topic_query_budget(self):
+        """Ensure topic detail doesn't issue queries per comment"""
+
+        topic = create_topics(self.test_user, topics=1, comments=10)[0]
+        url = reverse("forum:get_update_topic", kwargs={"pk": topic.pk})
+
+        # session, user, topic and comments state for ETag,
+        # topic with users, comments with authors
+        response = self.assertQueryBudget(6, self.auth_client.get, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["moderator"], f"{self.username}_0")
+        self.assertEqual(response.data["comment_count"], 10)
+
+
+class TestCommentPreview(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user("test", "test@gmail.com", "password")
+        self.topic = create_topics(
+            self.test_user, topics=1, comments=5, is_active=True
+        )[0]
+        self.list_url = reverse("forum:list_create_topics")
+
+    def test_default_preview(self):
+        """Ensure topic carries count, link and only the newest comments"""
+
+        response = self.client.get(self.list_url)
+        topic = response.data["results"][0]
+
+        newest = self.topic.comment_set.order_by("-created", "-id")[:3]
+        self.assertEqual(topic["comment_count"], 5)
+        self.assertEqual([c["id"] for c in topic["comments"]], [c.id for c in newest])
+        self.assertTrue(
+            topic["comments_url"].endswith(
+                reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+            )
+        )
+
+    def test_preview_size_from_request(self):
+        """Ensure number of embedded comments can be set per request"""
+
+        response = self.client.get(self.list_url, {"comments": 1})
+        self.assertEqual(len(response.data["results"][0]["comments"]), 1)
+
+        response = self.client.get(self.list_url, {"comments": 0})
+        self.assertEqual(response.data["results"][0]["comments"], [])
+
+        response = self.client.get(self.list_url, {"comments": "all"})
+        self.assertEqual(len(response.data["results"][0]["comments"]), 3)
+
+
+@mock.patch.object(CommentCursorPagination, "page_size", 2)
+@mock.patch.object(TopicCursorPagination, "page_size", 2)
+class TestCursorPagination(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topics = create_topics(
+            self.test_user, topics=5, comments=5, is_active=True
+        )
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def walk(self, client, url):
+        """Follow next links and collect ids of all pages"""
+        ids = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertNotIn("count", data)
+            ids += [row["id"] for row in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_topics_cursor(self):
+        """Ensure topics are paginated by cursor newest first"""
+
+        ids = self.walk(self.client, reverse("forum:list_create_topics"))
+        self.assertEqual(ids, [topic.id for topic in reversed(self.topics)])
+
+    def test_topics_cursor_stable_on_insert(self):
+        """Ensure new topics don't shift next page"""
+
+        url = reverse("forum:list_create_topics")
+        first = self.client.get(url).data
+        Topic.objects.create(author=self.test_user, title="New", is_active=True)
+        second = self.client.get(first["next"]).data
+
+        ids = [row["id"] for row in first["results"] + second["results"]]
+        self.assertEqual(ids, [topic.id for topic in reversed(self.topics)][:4])
+
+    def test_comments_cursor(self):
+        """Ensure comments are paginated by cursor without count query"""
+
+        topic = self.topics[0]
+        url = reverse("forum:create_comment", kwargs={"topic": topic.pk})
+        ids = self.walk(self.auth_client, url)
+        # session, user, comments state for ETag, comments
+        self.assertQueryBudget(4, self.auth_client.get, url)
+
+        expected = topic.comment_set.order_by("created", "id")
+        self.assertEqual(ids, [comment.id for comment in expected])
+
+    def test_page_number_mode(self):
+        """Ensure page numbers and count are still available"""
+
+        url = reverse("forum:list_create_topics")
+        response = self.client.get(url, {"page": 1})
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual(len(response.data["results"]), 5)
+
+
+class TestTopicSearch(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user("test", "test@gmail.com", "password")
+        self.url = reverse("forum:list_create_topics")
+
+        self.by_title = Topic.objects.create(
+            author=self.test_user, title="Running shoes", is_active=True
+        )
+        self.by_description = Topic.objects.create(
+            author=self.test_user,
+            title="Sport",
+            description="Which shoes are good for running?",
+            is_active=True,
+        )
+        self.by_comment = Topic.objects.create(
+            author=self.test_user, title="Weekend", is_active=True
+        )
+        self.comment = Comment.objects.create(
+            topic=self.by_comment, author=self.test_user, content="I went running"
+        )
+
+    def search(self, text):
+        response = self.client.get(self.url, {"search": text})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [topic["id"] for topic in response.data["results"]]
+
+    def test_search_ranked(self):
+        """Ensure title, description and comments are searched by relevance"""
+
+        ids = self.search("run")
+        self.assertEqual(
+            ids, [self.by_title.id, self.by_description.id, self.by_comment.id]
+        )
+        self.assertEqual(self.search("weekend"), [self.by_comment.id])
+        self.assertEqual(self.search("nothing"), [])
+
+    def test_search_vector_updated_on_write(self):
+        """Ensure edited topics and comments are found by new content"""
+
+        self.by_title.title = "Hiking boots"
+        self.by_title.save()
+        self.assertEqual(self.search("boots"), [self.by_title.id])
+
+        self.comment.delete_comment()
+        self.assertNotIn(self.by_comment.id, self.search("running"))
+
+    def test_long_thread(self):
+        """Ensure comments of a thread larger than a tsvector can hold are found"""
+
+        # About 2 MB of distinct words, over the 1 MB limit of one tsvector
+        Comment.objects.bulk_add(
+            [
+                Comment(
+                    topic=self.by_comment,
+                    author=self.test_user,
+                    content=" ".join(f"c{number}w{word}" for word in range(20)),
+                )
+                for number in range(6000)
+            ]
+        )
+        self.client.force_login(self.test_user)
+        url = reverse("forum:create_comment", kwargs={"topic": self.by_comment.pk})
+        response = self.client.post(url, {"content": "Hiking is great"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.search("c0w0"), [self.by_comment.id])
+        self.assertEqual(self.search("c5999w19"), [self.by_comment.id])
+        self.assertEqual(self.search("hiking"), [self.by_comment.id])
+
+
+class TestTopicAutocomplete(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user("test", "test@gmail.com", "password")
+        self.url = reverse("forum:autocomplete_topics")
+
+        titles = ["Django performance", "Postgres tuning", "Djangonauts meetup"]
+        self.topics = {
+            title: Topic.objects.create(
+                author=self.test_user, title=title, is_active=True
+            )
+            for title in titles
+        }
+        Topic.objects.create(author=self.test_user, title="Django drafts")
+
+    def test_prefix_match(self):
+        """Ensure prefix matches are returned first with id and title only"""
+
+        response = self.client.get(self.url, {"q": "djang"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {topic["title"] for topic in response.data},
+            {"Django performance", "Djangonauts meetup"},
+        )
+        self.assertEqual(set(response.data[0]), {"id", "title"})
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+    def test_typo_tolerance(self):
+        """Ensure titles are found with a typo in the word"""
+
+        response = self.client.get(self.url, {"q": "tunnig"})
+        self.assertEqual(
+            response.data,
+            [{"id": self.topics["Postgres tuning"].id, "title": "Postgres tuning"}],
+        )
+
+    def test_prefix_with_wildcards(self):
+        """Ensure LIKE wildcards in the text are matched literally"""
+
+        Topic.objects.create(author=self.test_user, title="100% Django")
+        Topic.objects.create(author=self.test_user, title="1000 tips")
+        topics = Topic.objects.filter(title__iprefix="100%")
+        self.assertEqual([topic.title for topic in topics], ["100% Django"])
+        self.assertFalse(Topic.objects.filter(title__iprefix="_jango").exists())
+        self.assertEqual(Topic.objects.filter(title__iprefix="DJANGO").count(), 3)
+
+    def test_index_used(self):
+        """Ensure both prefix and similar words are matched by the trigram index"""
+
+        with CaptureQueriesContext(connection) as context:
+            Topic.objects.autocomplete("djang")
+        sql = next(
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn("forum_topic_title_trgm", plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_short_query_and_limit(self):
+        """Ensure short queries don't hit db and number of results is capped"""
+
+        response = self.assertQueryBudget(0, self.client.get, self.url, {"q": "d"})
+        self.assertEqual(response.data, [])
+
+        with self.settings(FORUM_AUTOCOMPLETE_LIMIT=1):
+            response = self.client.get(self.url, {"q": "djang"})
+        self.assertEqual(len(response.data), 1)
+
+    def test_explicit_zero(self):
+        """Ensure zero limit and threshold aren't replaced by defaults"""
+
+        self.assertEqual(list(Topic.objects.autocomplete("djang", limit=0)), [])
+        titles = Topic.objects.autocomplete("postgres", limit=10, threshold=0)
+        self.assertEqual(len(titles), Topic.objects.count())
+
+
+class TestTopicActivity(APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.another_user = User.objects.create_user(
+            "another", "another@gmail.com", self.password
+        )
+        self.topic = Topic.objects.create(
+            author=self.test_user, title="Topic", is_active=True
+        )
+        self.quiet_topic = Topic.objects.create(
+            author=self.test_user, title="Quiet", is_active=True
+        )
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def test_counters_on_create_and_delete(self):
+        """Ensure counters follow comments created and deleted through api"""
+
+        url = reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+        first = self.auth_client.post(url, {"content": "first"}, format="json")
+        second = self.auth_client.post(url, {"content": "second"}, format="json")
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 2)
+        self.assertEqual(self.topic.last_comment_author, self.test_user)
+        self.assertEqual(
+            self.topic.last_comment_at,
+            Comment.objects.get(pk=second.data["id"]).created,
+        )
+
+        for comment in (second, first):
+            delete_url = reverse(
+                "forum:delete_comment", kwargs={"pk": comment.data["id"]}
+            )
+            self.auth_client.put(delete_url, {}, format="json")
+            self.auth_client.put(delete_url, {}, format="json")
+
+            self.topic.refresh_from_db()
+            if comment is second:
+                self.assertEqual(self.topic.comment_count, 1)
+                self.assertEqual(
+                    self.topic.last_comment_at,
+                    Comment.objects.get(pk=first.data["id"]).created,
+                )
+
+        self.assertEqual(self.topic.comment_count, 0)
+        self.assertIsNone(self.topic.last_comment_at)
+        self.assertIsNone(self.topic.last_comment_author)
+
+    def test_topic_save_keeps_counters(self):
+        """Ensure saving a loaded topic doesn't overwrite counters"""
+
+        stale = Topic.objects.get(pk=self.topic.pk)
+        Comment.objects.create(topic=self.topic, author=self.test_user, content="c")
+
+        stale.title = "Renamed"
+        stale.save()
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.title, "Renamed")
+        self.assertEqual(self.topic.comment_count, 1)
+
+    def test_activity_ordering(self):
+        """Ensure topics can be ordered by activity"""
+
+        Comment.objects.create(topic=self.topic, author=self.test_user, content="c")
+        url = reverse("forum:list_create_topics")
+
+        response = self.client.get(url, {"ordering": "-comment_count"})
+        ids = [topic["id"] for topic in response.data["results"]]
+        self.assertEqual(ids, [self.topic.id, self.quiet_topic.id])
+
+        response = self.client.get(url, {"ordering": "-last_comment_at"})
+        ids = [topic["id"] for topic in response.data["results"]]
+        self.assertEqual(ids, [self.topic.id, self.quiet_topic.id])
+        self.assertEqual(response.data["results"][0]["last_comment_author"], "test")
+
+    def test_reconcile_command(self):
+        """Ensure command fixes counters which drifted"""
+
+        comment = Comment.objects.create(
+            topic=self.topic, author=self.another_user, content="c"
+        )
+        Topic.objects.update(comment_count=10, last_comment_at=None)
+
+        out = StringIO()
+        call_command("update_topic_activity", stdout=out)
+        self.assertIn("Updated 2 topics", out.getvalue())
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 1)
+        self.assertEqual(self.topic.last_comment_at, comment.created)
+        self.assertEqual(self.topic.last_comment_author, self.another_user)
+
+        out = StringIO()
+        call_command("update_topic_activity", stdout=out)
+        self.assertIn("Updated 0 topics", out.getvalue())
+
+
+class TestExplainEndpoints(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user("test", "test@gmail.com", "password")
+        create_topics(self.test_user, topics=3, comments=3, is_active=True)
+
+    def test_no_large_tables(self):
+        """Ensure all endpoints are explained and small tables aren't flagged"""
+
+        out = StringIO()
+        call_command("explain_endpoints", "--analyze", stdout=out)
+        self.assertIn("topics: search", out.getvalue())
+        self.assertIn("No sequential scans on large tables", out.getvalue())
+
+    def test_cached_lists_explained(self):
+        """Ensure anonymous lists run their queries with the cache filled"""
+
+        call_command("explain_endpoints", stdout=StringIO())
+        out = StringIO()
+        call_command("explain_endpoints", stdout=out)
+        topics = out.getvalue().split("topics: search")[0]
+        self.assertIn('SELECT "forum_topic"."id"', topics)
+
+    def test_seq_scan_flagged(self):
+        """Ensure sequential scans on tables over the limit fail the command"""
+
+        with self.assertRaisesMessage(CommandError, "Sequential scans"):
+            call_command("explain_endpoints", "--min-rows", "0", stdout=StringIO())
+
+
+class TestResponseCache(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        # ETag from generation, as production settings require a shared cache
+        shared = mock.patch("forum.api.views.is_shared", return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        cache.clear()
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(
+            self.test_user, topics=1, comments=2, is_active=True
+        )[0]
+        self.url = reverse("forum:list_create_topics")
+
+    def test_anonymous_list_cached(self):
+        """Ensure repeated anonymous requests are served without queries"""
+
+        settings = self.settings(FORUM_RESPONSE_CACHE_STATS=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        first = self.client.get(self.url, {"search": "topic"})
+        self.assertEqual(first["X-Cache"], "MISS")
+
+        second = self.assertQueryBudget(
+            0, self.client.get, self.url, {"search": "topic"}
+        )
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+
+        # Another query string is another page
+        third = self.client.get(self.url, {"comments": 1})
+        self.assertEqual(third["X-Cache"], "MISS")
+        self.assertEqual(response_cache.get_stats(), {"hits": 1, "misses": 2})
+
+    def test_cached_per_host(self):
+        """Ensure absolute urls of other host or scheme are never served"""
+
+        settings = self.settings(ALLOWED_HOSTS=[".example.com"])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client.get(self.url, HTTP_HOST="one.example.com")
+        response = self.client.get(self.url, HTTP_HOST="two.example.com")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn("two.example.com", response.data["results"][0]["comments_url"])
+
+        response = self.client.get(self.url, HTTP_HOST="two.example.com", secure=True)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertTrue(response.data["results"][0]["comments_url"].startswith("https"))
+
+        response = self.client.get(self.url, HTTP_HOST="two.example.com")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_stats_off(self):
+        """Ensure hits and misses aren't counted by default"""
+
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(response_cache.get_stats(), {"hits": 0, "misses": 0})
+
+    def test_cache_dropped_on_write(self):
+        """Ensure saved topics and comments are visible right away"""
+
+        self.client.get(self.url)
+        Comment.objects.create(topic=self.topic, author=self.test_user, content="c")
+
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["comment_count"], 3)
+
+        self.topic.title = "Renamed"
+        self.topic.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["results"][0]["title"], "Renamed")
+
+    def test_authenticated_not_cached(self):
+        """Ensure responses of authenticated users aren't cached"""
+
+        self.client.login(username=self.username, password=self.password)
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header("X-Cache"))
+
+    def test_cache_off(self):
+        """Ensure zero timeout turns the cache off"""
+
+        with self.settings(FORUM_RESPONSE_CACHE_TIMEOUT=0):
+            self.client.get(self.url)
+            response = self.client.get(self.url)
+        self.assertFalse(response.has_header("X-Cache"))
+        self.assertEqual(response_cache.get_stats(), {"hits": 0, "misses": 0})
+
+    def test_stats_command(self):
+        """Ensure hit and miss counts are reported"""
+
+        with self.settings(FORUM_RESPONSE_CACHE_STATS=True):
+            self.client.get(self.url)
+            self.client.get(self.url)
+
+        out = StringIO()
+        call_command("response_cache_stats", "--reset", stdout=out)
+        self.assertIn("hits: 1, misses: 1", out.getvalue())
+        self.assertEqual(response_cache.get_stats(), {"hits": 0, "misses": 0})
+
+
+class TestConditionalGet(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(
+            self.test_user, topics=1, comments=2, is_active=True
+        )[0]
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def assertNotModified(self, client, url, budget):
+        """Fetch url, then revalidate it and return first response"""
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header("ETag"))
+
+        revalidated = self.assertQueryBudget(
+            budget, client.get, url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(revalidated.content, b"")
+        return response
+
+    def test_topic_detail(self):
+        """Ensure unchanged topic gets 304 and edited comment changes ETag"""
+
+        url = reverse("forum:get_update_topic", kwargs={"pk": self.topic.pk})
+        # session, user, topic, comments aggregate
+        response = self.assertNotModified(self.auth_client, url, 4)
+
+        revalidated = self.auth_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        comment = self.topic.comment_set.first()
+        comment.content = "edited"
+        comment.update_comment()
+        changed = self.auth_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_topic_detail_permission(self):
+        """Ensure 304 isn't given to users who can't see the topic"""
+
+        url = reverse("forum:get_update_topic", kwargs={"pk": self.topic.pk})
+        etag = self.auth_client.get(url)["ETag"]
+
+        User.objects.create_user("another", "another@gmail.com", self.password)
+        self.client.login(username="another", password=self.password)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_topic_list(self):
+        """Ensure topic list is revalidated without queries until forum changes"""
+
+        url = reverse("forum:list_create_topics")
+        with mock.patch("forum.api.views.is_shared", return_value=True):
+            response = self.assertNotModified(self.client, url, 0)
+
+            Topic.objects.create(author=self.test_user, title="New", is_active=True)
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+
+    def test_topic_list_without_shared_cache(self):
+        """Ensure topic list isn't validated by a generation of this process"""
+
+        url = reverse("forum:list_create_topics")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_comment_list(self):
+        """Ensure comment thread gets 304 until a comment is added"""
+
+        url = reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+        # session, user, comments aggregate
+        response = self.assertNotModified(self.auth_client, url, 3)
+
+        self.auth_client.post(url, {"content": "new"}, format="json")
+        changed = self.auth_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(changed.json()["results"]), 3)
+
+
+class TestCommentFragments(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_fragments.clear()
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=3)[0]
+        self.url = reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def test_spliced_list_parity(self):
+        """Ensure spliced response is the same JSON as serialized one"""
+
+        comments = self.topic.comment_set.order_by("created", "id")
+        expected = CommentSerializer(comments, many=True).data
+
+        for _ in range(2):
+            response = self.auth_client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertEqual(data["results"], json.loads(json.dumps(expected)))
+            self.assertEqual(data["next"], None)
+
+        response = self.auth_client.get(self.url, {"page": 1})
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_fragments_invalidated(self):
+        """Ensure edited and deleted comments are rendered again"""
+
+        comment = Comment.objects.create(
+            topic=self.topic, author=self.test_user, content="own"
+        )
+        self.auth_client.get(self.url)
+        self.assertEqual(len(local_fragments), 4)
+
+        edit_url = reverse("forum:edit_comment", kwargs={"pk": comment.pk})
+        response = self.auth_client.patch(
+            edit_url, {"content": "edited"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(local_fragments), 3)
+
+        response = self.auth_client.get(self.url)
+        self.assertEqual(response.json()["results"][-1]["content"], "edited")
+
+        delete_url = reverse("forum:delete_comment", kwargs={"pk": comment.pk})
+        self.auth_client.put(delete_url, {}, format="json")
+        response = self.auth_client.get(self.url)
+        self.assertEqual(response.json()["results"][-1]["status"], "deleted")
+
+    def test_stale_version_not_served(self):
+        """Ensure fragment of older version isn't served after update elsewhere"""
+
+        self.auth_client.get(self.url)
+        comment = self.topic.comment_set.order_by("created", "id").first()
+        Comment.objects.filter(pk=comment.pk).update(
+            content="changed", updated=timezone.now()
+        )
+
+        response = self.auth_client.get(self.url)
+        self.assertEqual(response.json()["results"][0]["content"], "changed")
+
+    def test_lru_eviction(self):
+        """Ensure in-process tier stays in its memory limit"""
+
+        fragments = LRUFragments(max_bytes=10)
+        fragments.set(1, "v1", b"aaaa")
+        fragments.set(2, "v1", b"bbbb")
+        self.assertEqual(fragments.get(1, "v1"), b"aaaa")
+
+        fragments.set(3, "v1", b"cccc")
+        self.assertEqual(len(fragments), 2)
+        self.assertIsNone(fragments.get(2, "v1"))
+        self.assertEqual(fragments.get(1, "v1"), b"aaaa")
+        self.assertIsNone(fragments.get(1, "v2"))
+        self.assertLessEqual(fragments.size, 10)
+
+
+class TestRowSerializers(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topics = create_topics(
+            self.test_user, topics=3, comments=4, is_active=True
+        )
+        Topic.objects.filter(pk=self.topics[0].pk).update(
+            image="topics/cover.png",
+            image_variants={
+                "source": "topics/cover.png",
+                "thumbnail": "topics/cover_thumbnail.png",
+            },
+        )
+        Topic.objects.filter(pk=self.topics[1].pk).update(moderator=None)
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def assertSameAsSerializer(self, url, queryset, params=None, preview_size=3):
+        response = self.auth_client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        serializer = TopicSerializer(
+            queryset.with_related(preview_size),
+            many=True,
+            context={"request": response.wsgi_request},
+        )
+        expected = json.loads(json.dumps(serializer.data))
+        self.assertEqual(response.json()["results"], expected)
+
+    def test_list_parity(self):
+        """Ensure rows are serialized the same way as model instances"""
+
+        url = reverse("forum:list_create_topics")
+        topics = Topic.objects.filter(is_active=True).order_by("-created", "-id")
+        self.assertSameAsSerializer(url, topics)
+        self.assertSameAsSerializer(url, topics, {"page": 1})
+        self.assertSameAsSerializer(url, topics, {"comments": 0}, preview_size=0)
+
+        url = reverse("forum:list_create_own_topics")
+        topics = Topic.objects.filter(author=self.test_user).order_by("-created")
+        self.assertSameAsSerializer(url, topics)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_serializers", rounds=1, stdout=out)
+        self.assertIn("TopicSerializer", out.getvalue())
+        self.assertIn("TopicRowSerializer", out.getvalue())
+
+
+class TestExport(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=5)[0]
+        Comment.objects.create(topic=self.topic, author=self.test_user, content="own")
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def export(self, url):
+        with self.settings(FORUM_EXPORT_CHUNK_SIZE=2):
+            response = self.auth_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            chunks = self.assertQueryBudget(3, list, response.streaming_content)
+        return response, chunks
+
+    def test_thread_ndjson(self):
+        """Ensure thread is streamed in batches with the list endpoint's rows"""
+
+        url = reverse(
+            "forum:export_topic_thread",
+            kwargs={"topic": self.topic.pk, "export_format": "ndjson"},
+        )
+        response, chunks = self.export(url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(chunks), 3)
+
+        rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        comments = self.auth_client.get(
+            reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+        )
+        self.assertEqual(rows, comments.json()["results"])
+
+    def test_thread_csv(self):
+        url = reverse(
+            "forum:export_topic_thread",
+            kwargs={"topic": self.topic.pk, "export_format": "csv"},
+        )
+        response, chunks = self.export(url)
+        self.assertIn("attachment;", response["Content-Disposition"])
+
+        rows = list(csv.DictReader(b"".join(chunks).decode().splitlines()))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]["content"], "own")
+        self.assertEqual(rows[-1]["author"], self.username)
+
+    def test_user_activity(self):
+        url = reverse("forum:export_own_activity", kwargs={"export_format": "csv"})
+        response, chunks = self.export(url)
+
+        rows = list(csv.DictReader(b"".join(chunks).decode().splitlines()))
+        self.assertEqual([row["type"] for row in rows], ["topic", "comment"])
+        self.assertEqual(rows[0]["title"], self.topic.title)
+        self.assertEqual(rows[1]["topic"], str(self.topic.pk))
+
+        url = reverse("forum:export_own_activity", kwargs={"export_format": "ndjson"})
+        response = self.auth_client.get(url, HTTP_ACCEPT="application/x-ndjson")
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual(json.loads(lines[1])["content"], "own")
+
+    def test_unknown_format(self):
+        url = reverse(
+            "forum:export_topic_thread",
+            kwargs={"topic": self.topic.pk, "export_format": "xml"},
+        )
+        response = self.auth_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestBulkComments(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topics = create_topics(self.test_user, topics=2, comments=1)
+        self.closed = Topic.objects.create(
+            author=self.test_user, title="Closed", closed=True
+        )
+        self.url = reverse("forum:bulk_create_comments")
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def test_bulk_create(self):
+        """Ensure valid comments are created at once and bad ones reported"""
+
+        first, second = self.topics
+        items = [
+            {"topic": first.pk, "content": "one"},
+            {"topic": second.pk, "content": "two"},
+            {"topic": self.closed.pk, "content": "closed"},
+            {"topic": 0, "content": "missing"},
+            {"topic": first.pk},
+            {"topic": first.pk, "content": "three"},
+        ]
+        response = self.assertQueryBudget(
+            11, self.auth_client.post, self.url, items, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        results = response.json()
+        self.assertEqual(
+            [result.get("content") for result in results[:2]], ["one", "two"]
+        )
+        self.assertEqual(results[2]["errors"]["topic"], ["The topic is closed"])
+        self.assertEqual(results[3]["errors"]["topic"], ["Topic not found"])
+        self.assertIn("content", results[4]["errors"])
+        self.assertEqual(results[5]["author"], self.username)
+
+        first.refresh_from_db()
+        self.assertEqual(first.comment_count, 3)
+        self.assertEqual(
+            first.last_comment_at.isoformat(),
+            first.comment_set.latest("created").created.isoformat(),
+        )
+        self.assertEqual(first.last_comment_author, self.test_user)
+        self.assertEqual(list(Topic.objects.search("three")), [first])
+        self.assertFalse(self.closed.comment_set.exists())
+
+    def test_topics_locked(self):
+        """Ensure topics are locked in id order before comments are inserted"""
+
+        items = [
+            {"topic": topic.pk, "content": "locked"} for topic in reversed(self.topics)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.auth_client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        queries = [query["sql"] for query in context.captured_queries]
+        lock = next(
+            index
+            for index, sql in enumerate(queries)
+            if sql.startswith('SELECT "forum_topic"') and sql.endswith("FOR UPDATE")
+        )
+        self.assertIn('ORDER BY "forum_topic"."id" ASC', queries[lock])
+        insert = next(
+            index
+            for index, sql in enumerate(queries)
+            if sql.startswith('INSERT INTO "forum_comment"')
+        )
+        self.assertLess(lock, insert)
+        # Lock and insert run in one transaction: a savepoint opened before
+        # the lock is released only after the insert
+        savepoint = queries[lock - 1]
+        self.assertTrue(savepoint.startswith("SAVEPOINT"))
+        released = "RELEASE " + savepoint
+        self.assertIn(released, queries[insert:])
+
+    def test_nothing_created(self):
+        response = self.auth_client.post(
+            self.url, [{"topic": self.closed.pk, "content": "x"}], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.auth_client.post(self.url, {"content": "x"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(FORUM_BULK_COMMENTS_MAX=1):
+            items = [{"topic": self.topics[0].pk, "content": "x"}] * 2
+            response = self.auth_client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.topics[0].comment_set.count(), 1)
+
+
+class TestBulkModeration(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.other_user = User.objects.create_user(
+            "other", "other@gmail.com", self.password
+        )
+        self.own = create_topics(self.test_user, topics=2, comments=2, is_active=True)
+        self.foreign = create_topics(self.other_user, topics=1, comments=2)[0]
+        self.spammer = User.objects.get(username="test_0")
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def test_close_and_deactivate(self):
+        """Ensure only topics the user may moderate are changed by one UPDATE"""
+
+        url = reverse("forum:moderate_topics")
+        ids = [topic.pk for topic in self.own] + [self.foreign.pk]
+        generation = response_cache.get_generation()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.auth_client.post(
+                url, {"ids": ids, "action": "close"}, format="json"
+            )
+        self.assertEqual(response.json(), {"updated": 2})
+        updates = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "forum_topic"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertNotEqual(response_cache.get_generation(), generation)
+
+        self.assertEqual(Topic.objects.filter(closed=True).count(), 2)
+        self.assertFalse(Topic.objects.get(pk=self.foreign.pk).closed)
+
+        response = self.auth_client.post(
+            url, {"ids": ids, "action": "close"}, format="json"
+        )
+        self.assertEqual(response.json(), {"updated": 0})
+        response = self.auth_client.post(
+            url, {"ids": ids, "action": "deactivate"}, format="json"
+        )
+        self.assertEqual(response.json(), {"updated": 2})
+
+    def test_delete_comments_of_author(self):
+        """Ensure all user's comments in moderated topics are deleted at once"""
+
+        url = reverse("forum:moderate_comments")
+        response = self.assertQueryBudget(
+            10,
+            self.auth_client.post,
+            url,
+            {"author": self.spammer.username},
+            format="json",
+        )
+        self.assertEqual(response.json(), {"deleted": 2})
+
+        for topic in self.own:
+            topic.refresh_from_db()
+            self.assertEqual(topic.comment_count, 1)
+            self.assertNotEqual(topic.last_comment_author, self.spammer)
+        self.assertEqual(self.foreign.comment_set.filter(status="deleted").count(), 0)
+        self.assertEqual(
+            Comment.objects.filter(author=self.spammer, status="deleted").count(), 2
+        )
+
+    def test_delete_comments_by_ids(self):
+        url = reverse("forum:moderate_comments")
+        ids = list(Comment.objects.values_list("id", flat=True))
+        response = self.auth_client.post(url, {"ids": ids}, format="json")
+        self.assertEqual(response.json(), {"deleted": 4})
+
+        response = self.auth_client.post(url, {"ids": ids}, format="json")
+        self.assertEqual(response.json(), {"deleted": 0})
+
+        self.test_user.is_staff = True
+        self.test_user.save()
+        response = self.auth_client.post(url, {"ids": ids}, format="json")
+        self.assertEqual(response.json(), {"deleted": 2})
+        self.assertEqual(Topic.objects.get(pk=self.foreign.pk).comment_count, 0)
+
+        response = self.auth_client.post(url, {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_own_comments_in_closed_topic(self):
+        """Ensure own comments are deleted only while the topic is open"""
+
+        comment = Comment.objects.create(
+            topic=self.foreign, author=self.test_user, content="own"
+        )
+        Topic.objects.filter(pk=self.foreign.pk).close()
+        url = reverse("forum:moderate_comments")
+        response = self.auth_client.post(url, {"ids": [comment.pk]}, format="json")
+        self.assertEqual(response.json(), {"deleted": 0})
+
+        Topic.objects.filter(pk=self.foreign.pk).update(closed=False)
+        response = self.auth_client.post(url, {"ids": [comment.pk]}, format="json")
+        self.assertEqual(response.json(), {"deleted": 1})
+
+    def test_soft_delete_locks_rows(self):
+        """Ensure only comments locked and counted in topics are deleted"""
+
+        comments = Comment.objects.filter(author=self.spammer)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(comments.soft_delete(), 2)
+        queries = [query["sql"] for query in context.captured_queries]
+        lock = next(index for index, sql in enumerate(queries) if "FOR UPDATE" in sql)
+        update = queries[lock + 1]
+        self.assertTrue(update.startswith('UPDATE "forum_comment"'))
+        self.assertIn('WHERE "forum_comment"."id" IN', update)
+        self.assertNotIn("author_id", update)
+
+
+class TestModerators(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.password = "password"
+        self.admin = User.objects.create_superuser(
+            "admin", "admin@gmail.com", self.password
+        )
+        self.moderator = User.objects.create_user(
+            "moderator", "moderator@gmail.com", self.password
+        )
+        UserProfile.objects.create(user=self.moderator)
+        self.topics = create_topics(self.admin, topics=3, comments=1)
+        self.previous = User.objects.get(username="admin_0")
+
+        self.admin_client = APIClient()
+        self.admin_client.login(username="admin", password=self.password)
+        self.moderator_client = APIClient()
+        self.moderator_client.login(username="moderator", password=self.password)
+
+    def test_permission_compares_ids(self):
+        topic = Topic.objects.get(pk=self.topics[0].pk)
+        request = APIRequestFactory().get("/")
+        request.user = self.previous
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                IsModeratorOrOwner().has_object_permission(request, None, topic)
+            )
+            request.user = self.moderator
+            self.assertFalse(
+                IsModeratorOrOwner().has_object_permission(request, None, topic)
+            )
+
+    def test_assign_moderator(self):
+        """Ensure admin attaches moderator to many topics in one transaction"""
+
+        url = reverse("forum:assign_moderator")
+        ids = [topic.pk for topic in self.topics[:2]]
+        data = {"ids": ids, "moderator": "moderator"}
+
+        response = self.moderator_client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # Cached ids of both moderators are replaced
+        self.assertEqual(len(Topic.objects.moderated_topic_ids(self.previous)), 3)
+        self.assertEqual(Topic.objects.moderated_topic_ids(self.moderator), [])
+        response = self.admin_client.post(url, data, format="json")
+        self.assertEqual(response.json(), {"updated": 2})
+        self.assertEqual(sorted(Topic.objects.moderated_topic_ids(self.moderator)), ids)
+        self.assertEqual(
+            Topic.objects.moderated_topic_ids(self.previous), [self.topics[2].pk]
+        )
+        self.assertTrue(UserProfile.objects.get(user=self.moderator).is_moderator)
+
+        response = self.admin_client.post(url, data, format="json")
+        self.assertEqual(response.json(), {"updated": 0})
+
+    def test_attach_moderator(self):
+        url = reverse("forum:attaching_moderator", kwargs={"pk": self.topics[0].pk})
+        response = self.admin_client.put(
+            url, {"moderator": self.moderator.pk}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Topic.objects.moderated_topic_ids(self.moderator), [self.topics[0].pk]
+        )
+
+        # Topic can be edited by the new moderator only
+        url = reverse("forum:get_update_topic", kwargs={"pk": self.topics[0].pk})
+        response = self.moderator_client.patch(url, {"title": "New"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_moderated_topics_list(self):
+        """Ensure the list is served from cached ids and changes on save"""
+
+        url = reverse("forum:list_moderated_topics")
+        response = self.moderator_client.get(url)
+        self.assertEqual(response.json()["count"], 0)
+
+        # Saved with other moderator, e.g. in admin
+        topic = Topic.objects.get(pk=self.topics[1].pk)
+        topic.moderator = self.moderator
+        topic.save()
+        self.assertEqual(len(Topic.objects.moderated_topic_ids(self.previous)), 2)
+
+        self.moderator_client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.moderator_client.get(url)
+        self.assertEqual(
+            [topic["title"] for topic in response.json()["results"]], ["Topic 1"]
+        )
+        lookups = [
+            query
+            for query in context.captured_queries
+            if 'WHERE "forum_topic"."moderator_id" =' in query["sql"]
+        ]
+        self.assertEqual(lookups, [])
+
+        topic.delete()
+        self.assertEqual(Topic.objects.moderated_topic_ids(self.moderator), [])
+
+
+class TestCommentWritePath(APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=1)[0]
+        self.comment = Comment.objects.create(
+            topic=self.topic, author=self.test_user, content="own"
+        )
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def write(self, method, url, data):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.auth_client, method)(url, data, format="json")
+        queries = [query["sql"] for query in context.captured_queries]
+        return response, queries
+
+    def assertSingleUpdate(self, queries):
+        updates = [sql for sql in queries if sql.startswith('UPDATE "forum_comment"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('FROM "forum_topic"', updates[0])
+        self.assertFalse(
+            [sql for sql in queries if sql.startswith('SELECT "forum_topic"')]
+        )
+
+    def test_edit_and_delete_queries(self):
+        """Ensure edit and delete write the comment by one conditional UPDATE"""
+
+        url = reverse("forum:edit_comment", kwargs={"pk": self.comment.pk})
+        response, queries = self.write("patch", url, {"content": "edited"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "updated")
+        self.assertSingleUpdate(queries)
+
+        url = reverse("forum:delete_comment", kwargs={"pk": self.comment.pk})
+        response, queries = self.write("put", url, {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "deleted")
+        self.assertSingleUpdate(queries)
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 1)
+        self.assertEqual(list(Topic.objects.search("edited")), [])
+
+    def test_edit_deleted_comment(self):
+        """Ensure deleted comment can't be brought back by an edit"""
+
+        url = reverse("forum:delete_comment", kwargs={"pk": self.comment.pk})
+        self.write("put", url, {})
+
+        url = reverse("forum:edit_comment", kwargs={"pk": self.comment.pk})
+        response, _ = self.write("patch", url, {"content": "edited"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.status, "deleted")
+
+        url = reverse("forum:delete_comment", kwargs={"pk": self.comment.pk})
+        response, _ = self.write("put", url, {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 1)
+
+    def test_closed_topic(self):
+        """Ensure comments of closed topic stay as they are"""
+
+        Topic.objects.filter(pk=self.topic.pk).update(closed=True)
+
+        url = reverse("forum:edit_comment", kwargs={"pk": self.comment.pk})
+        response, _ = self.write("patch", url, {"content": "edited"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse("forum:delete_comment", kwargs={"pk": self.comment.pk})
+        response, _ = self.write("put", url, {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.comment.refresh_from_db()
+        self.assertEqual(
+            (self.comment.content, self.comment.status), ("own", "created")
+        )
+
+
+class TestCommentWriteConcurrency(APITransactionTestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=1)[0]
+
+    def run_threads(self, *targets):
+        def run(target):
+            try:
+                target()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_create_waits_for_close(self):
+        """Ensure comment isn't created in the topic closed meanwhile"""
+
+        locked = threading.Event()
+        responses = []
+
+        def close():
+            with transaction.atomic():
+                Topic.objects.filter(pk=self.topic.pk).update(closed=True)
+                locked.set()
+                # Comment is posted while close isn't committed yet
+                threading.Event().wait(0.5)
+
+        def create():
+            locked.wait()
+            client = APIClient()
+            client.login(username=self.username, password=self.password)
+            url = reverse("forum:create_comment", kwargs={"topic": self.topic.pk})
+            responses.append(client.post(url, {"content": "late"}, format="json"))
+
+        self.run_threads(close, create)
+        self.assertEqual(responses[0].status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(self.topic.comment_set.filter(content="late").exists())
+
+    def test_concurrent_deletes(self):
+        """Ensure comment deleted by several requests at once is uncounted once"""
+
+        comment = self.topic.comment_set.get()
+        start = threading.Barrier(4)
+        results = []
+
+        def delete():
+            instance = Comment.objects.get(pk=comment.pk)
+            start.wait()
+            results.append(instance.delete_comment())
+
+        self.run_threads(*[delete] * 4)
+        self.assertEqual(results, [True] * 4)
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 0)
+        self.assertIsNone(self.topic.last_comment_at)
+
+
+class TestChangeFeed(APITestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic, self.other = create_topics(
+            self.test_user, topics=2, comments=2, is_active=True
+        )
+        self.url = reverse("forum:changes")
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+
+    def changes(self, url=None, since=None):
+        params = {"since": since} if since else {}
+        with self.settings(FORUM_CHANGES_SETTLE_SECONDS=0):
+            response = self.auth_client.get(url or self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_sync_deltas(self):
+        """Ensure only changes after the cursor are returned"""
+
+        data = self.changes()
+        self.assertEqual(len(data["topics"]), 2)
+        self.assertEqual(len(data["comments"]), 4)
+        self.assertFalse(data["more"])
+        self.assertNotIn("comments", data["topics"][0])
+
+        unchanged = self.changes(since=data["cursor"])
+        self.assertEqual(unchanged["topics"] + unchanged["comments"], [])
+        self.assertEqual(unchanged["cursor"], data["cursor"])
+
+        comment = self.topic.comment_set.first()
+        comment.delete_comment()
+        Topic.objects.filter(pk=self.other.pk).close()
+
+        data = self.changes(since=data["cursor"])
+        self.assertEqual([topic["id"] for topic in data["topics"]], [self.other.pk])
+        self.assertEqual(data["comments"][0]["id"], comment.pk)
+        self.assertEqual(data["comments"][0]["status"], "deleted")
+
+    def test_paging_and_topic_feed(self):
+        with self.settings(FORUM_CHANGES_LIMIT=4):
+            first = self.changes()
+            rest = self.changes(since=first["cursor"])
+        self.assertTrue(first["more"])
+        self.assertFalse(rest["more"])
+        ids = [
+            item["id"]
+            for data in (first, rest)
+            for item in data["topics"] + data["comments"]
+        ]
+        self.assertEqual(len(ids), 6)
+
+        url = reverse("forum:topic_changes", kwargs={"topic": self.topic.pk})
+        data = self.changes(url)
+        self.assertEqual([topic["id"] for topic in data["topics"]], [self.topic.pk])
+        self.assertEqual(
+            {comment["topic"] for comment in data["comments"]}, {self.topic.pk}
+        )
+
+    def test_inactive_topics_hidden(self):
+        """Ensure inactive topics are listed only to their author and moderator"""
+
+        Topic.objects.filter(pk=self.other.pk).deactivate()
+        stranger = User.objects.create_user("stranger", "stranger@gmail.com", "pw")
+        self.auth_client.force_login(stranger)
+
+        data = self.changes()
+        self.assertEqual([topic["id"] for topic in data["topics"]], [self.topic.pk])
+        self.assertEqual(
+            {comment["topic"] for comment in data["comments"]}, {self.topic.pk}
+        )
+        url = reverse("forum:topic_changes", kwargs={"topic": self.other.pk})
+        response = self.auth_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        Topic.objects.filter(pk=self.other.pk).update(moderator=stranger)
+        data = self.changes(url)
+        self.assertEqual([topic["id"] for topic in data["topics"]], [self.other.pk])
+        self.assertEqual(len(data["comments"]), 2)
+
+    def test_settle_window_and_invalid_cursor(self):
+        response = self.auth_client.get(self.url)
+        self.assertEqual(response.json()["topics"], [])
+        self.assertIsNone(response.json()["cursor"])
+
+        response = self.auth_client.get(self.url, {"since": "garbage"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestCommentStream(APITransactionTestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=1)[0]
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+        self.cookie = self.auth_client.cookies["sessionid"].OutputString(attrs=[])
+
+    def get_scope(self, topic=None, headers=()):
+        topic = topic or self.topic.pk
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": f"/api/v1/topics/{topic}/comments/stream/",
+            "query_string": b"",
+            "headers": [(b"cookie", self.cookie.encode()), *headers],
+        }
+
+    def open_stream(self, scope, scenario):
+        """Run scenario(read) with read() returning next chunk of the stream"""
+
+        async def run():
+            application = CommentStreamApplication(None)
+            messages = asyncio.Queue()
+            disconnect = asyncio.Event()
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {"type": "http.request", "body": b""}
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def read():
+                message = await asyncio.wait_for(messages.get(), 5)
+                return message.get("body", message.get("status"))
+
+            stream = asyncio.ensure_future(application(scope, receive, messages.put))
+            try:
+                return await scenario(read)
+            finally:
+                disconnect.set()
+                await stream
+                application.listener.close()
+
+        return asyncio.run(run())
+
+    def test_push_comments(self):
+        """Ensure new, edited and deleted comments are pushed to the stream"""
+
+        comment = Comment(topic=self.topic, author=self.test_user, content="live")
+
+        def edit():
+            comment.content = "edited"
+            comment.update_comment()
+
+        async def scenario(read):
+            self.assertEqual(await read(), 200)
+            self.assertIn(b"retry:", await read())
+            events = []
+            for write in (comment.save, edit, comment.delete_comment):
+                await database_sync_to_async(write)()
+                events.append(await read())
+            return events
+
+        events = self.open_stream(self.get_scope(), scenario)
+        self.assertEqual(
+            [event.split(b"\n")[1] for event in events],
+            [b"event: created", b"event: updated", b"event: deleted"],
+        )
+        data = json.loads(events[0].split(b"data: ")[1])
+        self.assertEqual(data["content"], "live")
+        self.assertEqual(data["author"], self.username)
+
+    def test_replay_and_heartbeat(self):
+        """Ensure reconnected client gets missed comments and heartbeats"""
+
+        comment = self.topic.comment_set.get()
+        cursor = encode_cursor(comment.updated, COMMENT, comment.pk)
+        Comment.objects.create(
+            topic=self.topic, author=self.test_user, content="missed"
+        )
+        scope = self.get_scope(headers=[(b"last-event-id", cursor.encode())])
+
+        async def scenario(read):
+            return [await read() for _ in range(3)]
+
+        with self.settings(FORUM_STREAM_HEARTBEAT_SECONDS=0.1):
+            _, replay, heartbeat = self.open_stream(scope, scenario)
+        self.assertIn(b"missed", replay)
+        self.assertNotIn(b'"comment"', replay)
+        self.assertEqual(heartbeat, b": heartbeat\n\n")
+
+    def test_rejected(self):
+        async def scenario(read):
+            return [await read(), await read()]
+
+        status_code, _ = self.open_stream(self.get_scope(topic=999999), scenario)
+        self.assertEqual(status_code, 404)
+
+        # Inactive topic of another user
+        User.objects.create_user("stranger", "stranger@gmail.com", self.password)
+        self.auth_client.login(username="stranger", password=self.password)
+        self.cookie = self.auth_client.cookies["sessionid"].OutputString(attrs=[])
+        headers = [(b"last-event-id", encode_cursor(timezone.now(), 0, 0).encode())]
+        scope = self.get_scope(headers=headers)
+        status_code, _ = self.open_stream(scope, scenario)
+        self.assertEqual(status_code, 404)
+
+        self.cookie = ""
+        status_code, body = self.open_stream(self.get_scope(), scenario)
+        self.assertEqual(status_code, 401)
+        self.assertIn(b"detail", body)
+
+    def test_concurrent_subscribe(self):
+        """Ensure streams subscribing at once share one LISTEN connection"""
+
+        async def scenario():
+            listener = CommentListener()
+            try:
+                await asyncio.gather(
+                    *(listener.subscribe(self.topic.pk) for _ in range(5))
+                )
+                return len(listener.subscriptions[self.topic.pk])
+            finally:
+                listener.close()
+
+        with mock.patch.object(psycopg2, "connect", wraps=psycopg2.connect) as connect:
+            self.assertEqual(asyncio.run(scenario()), 5)
+        self.assertEqual(connect.call_count, 1)
+
+    def test_slow_client_overflow(self):
+        """Ensure events of a slow client are dropped instead of piling up"""
+
+        async def scenario():
+            subscription = Subscription(self.topic.pk, size=2)
+            for message in (b"1", b"2", b"3", b"4"):
+                subscription.put(message)
+            return subscription
+
+        subscription = asyncio.run(scenario())
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertIs(subscription.queue.get_nowait(), OVERFLOW)
+
+
+class TestASGI(APITransactionTestCase):
+    def setUp(self):
+        self.username = "test"
+        self.password = "password"
+        self.test_user = User.objects.create_user(
+            self.username, "test@gmail.com", self.password
+        )
+        self.topic = create_topics(self.test_user, topics=1, comments=3)[0]
+
+        self.auth_client = APIClient()
+        self.auth_client.login(username=self.username, password=self.password)
+        self.cookie = self.auth_client.cookies["sessionid"].OutputString(attrs=[])
+
+    def test_async_read_view(self):
+        """Ensure reads of async view run in the pool and writes are kept"""
+
+        with self.settings(FORUM_ASYNC_VIEWS=True):
+            view = read_view(ListTopicView.as_view())
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        self.assertTrue(view.csrf_exempt)
+
+        request = APIRequestFactory().get("/api/v1/topics/", SERVER_NAME="localhost")
+        response = asyncio.run(view(request))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_rendered)
+
+        request = APIRequestFactory().post("/api/v1/topics/", {}, format="json")
+        response = asyncio.run(view(request))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        with self.settings(FORUM_ASYNC_VIEWS=False):
+            view = read_view(ListTopicView.as_view())
+        self.assertFalse(asyncio.iscoroutinefunction(view))
+
+    def test_streaming_export(self):
+        """Ensure streaming export reads from the database under ASGI"""
+
+        path = reverse(
+            "forum:export_topic_thread",
+            kwargs={"topic": self.topic.pk, "export_format": "ndjson"},
+        )
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"localhost"), (b"cookie", self.cookie.encode())],
+            "server": ("localhost", 80),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        with self.settings(FORUM_EXPORT_CHUNK_SIZE=1):
+            asyncio.run(ASGIHandler()(scope, receive, send))
+        self.assertEqual(messages[0]["status"], 200)
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        self.assertEqual(len(body.splitlines()), 3)
+        self.assertFalse(messages[-1].get("more_body", False))
+
+    def test_benchmark_command(self):
+        for mode in ("wsgi", "asgi"):
+            out = StringIO()
+            call_command(
+                "benchmark_servers",
+                mode=mode,
+                path="/api/v1/topics/autocomplete/?q=topic",
+                concurrency=[1, 4],
+                requests=8,
+                json=True,
+                stdout=out,
+            )
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual([result["concurrency"] for result in results], [1, 4])
+            self.assertEqual([result["errors"] for result in results], [0, 0])
+
+
+class TestDatabaseBackend(APITransactionTestCase):
+    def setUp(self):
+        # Wrappers of the test share slots with each other only
+        patcher = mock.patch.dict(DatabaseWrapper._slots, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_wrapper(self, **settings_dict):
+        wrapper = DatabaseWrapper(
+            dict(connection.settings_dict, **settings_dict), connection.alias
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_max_connections(self):
+        first, second = (
+            self.get_wrapper(MAX_CONNECTIONS=1, MAX_CONNECTIONS_TIMEOUT=0)
+            for _ in range(2)
+        )
+        first.ensure_connection()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+
+        # Slot is released when the connection closes
+        first.close()
+        second.ensure_connection()
+        self.assertIsNotNone(second.connection)
+
+    def test_health_check_replaces_dropped_connection(self):
+        wrapper = self.get_wrapper(CONN_MAX_AGE=None, CONN_HEALTH_CHECKS=True)
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            pid = cursor.fetchone()[0]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+        # Next request starts
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            self.assertNotEqual(cursor.fetchone()[0], pid)
+
+    def test_default_threads(self):
+        """Ensure threads follow cores within connections of the process"""
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop("DB_MAX_CONNECTIONS", None)
+            with mock.patch("multiprocessing.cpu_count", return_value=8):
+                self.assertEqual(default_threads(), 8)
+                os.environ["DB_MAX_CONNECTIONS"] = "6"
+                self.assertEqual(default_threads(), 6)
+            with mock.patch("multiprocessing.cpu_count", return_value=1):
+                self.assertEqual(default_threads(), 2)
+
+
+def make_image(size=(1200, 900), image_format="JPEG", **kwargs):
+    buffer = BytesIO()
+    Image.new("RGB", size, "red").save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+class TestImageProcessing(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        cache.clear()
+        self.user = User.objects.create_user("test", "test@gmail.com", "password")
+        self.auth_client = APIClient()
+        self.auth_client.login(username="test", password="password")
+
+    def create_topic(self, content, name="photo.jpg"):
+        upload = SimpleUploadedFile(name, content, content_type="image/jpeg")
+        return self.auth_client.post(
+            reverse("forum:list_create_topics"),
+            {"title": "Photo", "image": upload},
+            format="multipart",
+        )
+
+    def test_process_uploaded_image(self):
+        exif = Image.Exif()
+        exif[0x0110] = "Camera model"
+        response = self.create_topic(make_image(exif=exif.tobytes()))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["image_variants"], {})
+        original = Topic.objects.get().image.name
+        with Image.open(default_storage.path(original)) as image:
+            self.assertIn("exif", image.info)
+
+        call_command("process_images", once=True, stdout=StringIO())
+
+        topic = Topic.objects.get()
+        self.assertNotEqual(topic.image.name, original)
+        self.assertFalse(default_storage.exists(original))
+        with Image.open(topic.image.path) as image:
+            self.assertNotIn("exif", image.info)
+        with Image.open(
+            default_storage.path(topic.image_variants["thumbnail"])
+        ) as image:
+            self.assertEqual(image.size, (320, 240))
+
+        url = reverse("forum:get_update_topic", kwargs={"pk": topic.pk})
+        variants = self.auth_client.get(url).json()["image_variants"]
+        self.assertIn("medium", variants)
+        self.assertTrue(variants["thumbnail"].startswith("http://testserver/media/"))
+        response = self.auth_client.get(variants["thumbnail"])
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_upload_size_limit(self):
+        with self.settings(IMAGE_MAX_UPLOAD_BYTES=1024):
+            response = self.create_topic(make_image())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("image", response.json())
+
+    def test_invalid_image(self):
+        """Ensure broken image is processed once and has no variants"""
+
+        name = default_storage.save("broken.jpg", ContentFile(make_image()[:200]))
+        topic = Topic.objects.create(author=self.user, title="Broken", image=name)
+        call_command("process_images", once=True, stdout=StringIO())
+
+        topic.refresh_from_db()
+        self.assertIn("error", topic.image_variants)
+        self.assertEqual(topic.image.name, name)
+        out = StringIO()
+        call_command("process_images", once=True, stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_loaded_instance_keeps_processed_image(self):
+        topic = Topic.objects.get(pk=self.create_topic(make_image()).json()["id"])
+        call_command("process_images", once=True, stdout=StringIO())
+        processed = Topic.objects.get(pk=topic.pk)
+
+        # Stale instance doesn't write its image back
+        topic.title = "New title"
+        topic.save()
+        topic.refresh_from_db()
+        self.assertEqual(topic.image.name, processed.image.name)
+        self.assertEqual(topic.image_variants, processed.image_variants)
+
+        # New image is processed again
+        topic.image = default_storage.save("new.png", ContentFile(make_image()))
+        topic.save()
+        topic.refresh_from_db()
+        self.assertEqual(topic.image_variants, {})
+
+    def test_avatar(self):
+        profile = UserProfile.objects.create(
+            user=self.user,
+            avatar=default_storage.save("avatar.png", ContentFile(make_image())),
+        )
+        call_command("process_images", once=True, stdout=StringIO())
+
+        profile.refresh_from_db()
+        self.assertIn("thumbnail", profile.avatar_variants)
+        url = reverse("accounts:update_user_profile", kwargs={"username": "test"})
+        variants = self.auth_client.get(url).json()["profile"]["avatar_variants"]
+        self.assertEqual(set(variants), set(profile.avatar_variants) - {"source"})
+
+
+class TestMediaServing(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.content = bytes(range(256)) * 4
+        self.name = default_storage.save("files/data.bin", ContentFile(self.content))
+        self.url = reverse("media", kwargs={"path": self.name})
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Length"], "1024")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertFalse(response["ETag"].startswith("W/"))
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(response["Content-Range"], "bytes 10-19/1024")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-100")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-100:])
+        self.assertEqual(response["Content-Range"], "bytes 924-1023/1024")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1000-")
+        self.assertEqual(b"".join(response.streaming_content), self.content[1000:])
+        self.assertEqual(response["Content-Length"], "24")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2000-")
+        self.assertEqual(
+            response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+        # File changed since the client got its part
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_content_addressed_name_is_immutable(self):
+        name = default_storage.save("photo.0123456789ab.jpg", ContentFile(b"jpeg"))
+        response = self.client.get(reverse("media", kwargs={"path": name}))
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+    def test_missing_files(self):
+        for path in ("missing.bin", "files", "../settings.py", "files/../../x"):
+            response = self.client.get(reverse("media", kwargs={"path": path}))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, path)
+
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_accel_redirect(self):
+        with self.settings(MEDIA_ACCEL_REDIRECT="/protected/"):
+            response = self.client.get(self.url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/files/data.bin")
+        self.assertEqual(response.content, b"")
+        self.assertIn("ETag", response)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command("benchmark_media", size=1, requests=2, range_size=64, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("status 206", lines[2])
+        self.assertEqual(os.listdir(default_storage.location), ["files"])
+
+
+class TestBenchmark(APITestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.baseline = os.path.join(directory, "baseline.json")
+        self.options = dict(users=2, topics=2, comments=2, requests=2)
+
+    def test_report(self):
+        call_command(
+            "benchmark",
+            baseline=self.baseline,
+            save_baseline=True,
+            stdout=StringIO(),
+            **self.options,
+        )
+        with open(self.baseline) as file:
+            report = json.load(file)
+        endpoints = report["endpoints"]
+        self.assertIn("GET forum:list_create_topics (anonymous)", endpoints)
+        self.assertIn("PUT accounts:update_user_profile", endpoints)
+        for result in endpoints.values():
+            self.assertLessEqual(result["p50"], result["p99"])
+        self.assertEqual(endpoints["DELETE forum:delete_topic"]["bytes"], 0)
+        self.assertGreater(endpoints["GET forum:changes"]["queries"], 0)
+        self.assertFalse(User.objects.filter(username__startswith="benchmark").exists())
+
+        # Same run passes, fewer queries in baseline fail
+        call_command(
+            "benchmark",
+            baseline=self.baseline,
+            latency_tolerance=100,
+            stdout=StringIO(),
+            **self.options,
+        )
+        report["endpoints"]["GET forum:changes"]["queries"] -= 1
+        with open(self.baseline, "w") as file:
+            json.dump(report, file)
+        with self.assertRaisesMessage(CommandError, "GET forum:changes"):
+            call_command(
+                "benchmark",
+                baseline=self.baseline,
+                latency_tolerance=100,
+                stdout=StringIO(),
+                **self.options,
+            )
+
+    def test_every_endpoint_is_covered(self):
+        with mock.patch.object(forum_urls, "urlpatterns", forum_urls.urlpatterns[:]):
+            forum_urls.urlpatterns.append(
+                path("new/", lambda request: None, name="new")
+            )
+            with self.assertRaisesMessage(CommandError, "forum:new"):
+                call_command("benchmark", stdout=StringIO(), **self.options)
@@ -0,0 +1,52 @@
+"""
+Gunicorn config of production deployment:
+
+    gunicorn -c gunicorn.conf.py
+
+Pre-forks WEB_WORKERS processes, by default two per core plus one.
+WEB_SERVER=asgi serves project.asgi with uvicorn workers instead
+of project.wsgi with WEB_THREADS threads per worker, by default one
+per core, see project.workers
+"""
+
+import os
+
+import environ
+
+from project.workers import default_threads, default_workers
+
+env = environ.Env()
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings_production")
+
+bind = env("WEB_BIND", default="0.0.0.0:8000")
+workers = env.int("WEB_WORKERS", default=default_workers())
+
+if env("WEB_SERVER", default="wsgi") == "asgi":
+    wsgi_app = "project.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "project.wsgi:application"
+    worker_class = "gthread"
+    threads = env.int("WEB_THREADS", default=default_threads())
+
+# Load the app once before forking, workers share its memory
+preload_app = True
+
+# Recycle workers now and then, spread so they don't restart at once
+max_requests = env.int("WEB_MAX_REQUESTS", default=10000)
+max_requests_jitter = max_requests // 10
+
+timeout = env.int("WEB_TIMEOUT", default=30)
+graceful_timeout = env.int("WEB_GRACEFUL_TIMEOUT", default=30)
+keepalive = env.int("WEB_KEEPALIVE", default=5)
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading mustn't be shared with workers
+    from django.db import connections
+
+    connections.close_all()
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Imported after setup, they use models and settings
+from forum.handlers import ASGIHandler  # noqa: E402
+from forum.streams import CommentStreamApplication  # noqa: E402
+
+# Comment streams are served right here, the rest goes to Django
+application = CommentStreamApplication(ASGIHandler())
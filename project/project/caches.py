@@ -0,0 +1,18 @@
+"""
+Cache backends which aren't seen by other processes.
+
+Cached tokens, response generation and fragments are dropped by the process
+which made the change, so with several processes the cache must be shared
+"""
+
+from django.conf import settings
+
+PROCESS_LOCAL_BACKENDS = (
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+def is_shared(alias="default"):
+    """Cache is seen by every process, e.g. memcached"""
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_BACKENDS
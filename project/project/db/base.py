@@ -0,0 +1,84 @@
+import threading
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend for persistent connections.
+
+    Extra settings of the database:
+    CONN_HEALTH_CHECKS - check reused connection once per request before
+    the first query, so a connection dropped by the server isn't used;
+    MAX_CONNECTIONS - most connections open by the process at once,
+    others wait for MAX_CONNECTIONS_TIMEOUT seconds and fail
+    """
+
+    # Free connection slots of every database alias, shared by threads
+    _slots = {}
+    _slots_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self._holds_slot = False
+
+    def get_slots(self):
+        max_connections = self.settings_dict.get("MAX_CONNECTIONS")
+        if not max_connections:
+            return None
+        with self._slots_lock:
+            if self.alias not in self._slots:
+                self._slots[self.alias] = threading.BoundedSemaphore(max_connections)
+            return self._slots[self.alias]
+
+    def get_new_connection(self, conn_params):
+        slots = self.get_slots()
+        if slots is not None and not self._holds_slot:
+            timeout = self.settings_dict.get("MAX_CONNECTIONS_TIMEOUT", 10)
+            if not slots.acquire(timeout=timeout):
+                raise OperationalError(
+                    f"All {self.settings_dict['MAX_CONNECTIONS']} connections "
+                    f"to {self.alias!r} database of the process are busy"
+                )
+            self._holds_slot = True
+        try:
+            return super().get_new_connection(conn_params)
+        except Exception:
+            self._release_slot()
+            raise
+
+    def connect(self):
+        # New connection needs no check, also ensure_connection() is called
+        # while connecting before autocommit is set
+        self.health_check_done = True
+        super().connect()
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            self._release_slot()
+
+    def _release_slot(self):
+        if self._holds_slot:
+            self._holds_slot = False
+            self.get_slots().release()
+
+    def close_if_unusable_or_obsolete(self):
+        # Called when a request starts and finishes
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and self.settings_dict.get("CONN_HEALTH_CHECKS")
+            and not self.in_atomic_block
+        ):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
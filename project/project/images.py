@@ -0,0 +1,192 @@
+"""
+Processing of uploaded images, run by process_images command.
+
+Models keep names of processed files in a JSON field next to the image
+field, see ProcessedImageMixin. It's empty until the image is processed
+"""
+
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+
+from PIL import Image, ImageOps
+
+Image.init()
+# Variants in WebP are skipped when Pillow is built without it
+WEBP = "WEBP" in Image.SAVE
+
+
+def validate_image_size(file):
+    limit = settings.IMAGE_MAX_UPLOAD_BYTES
+    if file.size > limit:
+        raise ValidationError(f"Image can't be larger than {limit // 1024} KB")
+
+
+class ImageProcessingError(Exception):
+    """Stored file can't be processed as an image"""
+
+
+class ProcessedImageMixin:
+    """
+    Model which image is processed by process_images command.
+
+    The command replaces the image and writes its variants, so saving
+    a loaded instance writes them only when another image was set,
+    then variants are reset and the new image is processed again
+    """
+
+    image_field = "image"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get(cls.image_field)
+        return instance
+
+    @property
+    def variants_field(self):
+        return f"{self.image_field}_variants"
+
+    def get_image_skip_fields(self):
+        """Image fields a save of loaded instance mustn't write"""
+        fields = {self.image_field, self.variants_field}
+        if self.image_field in self.get_deferred_fields():
+            return fields
+        if getattr(self, self.image_field).name == getattr(self, "_loaded_image", None):
+            return fields
+        setattr(self, self.variants_field, {})
+        return set()
+
+    def image_saved(self):
+        if self.image_field not in self.get_deferred_fields():
+            self._loaded_image = getattr(self, self.image_field).name
+
+
+def get_variant_urls(variants, storage, request=None):
+    """URLs of processed variants, empty while the image isn't processed"""
+    urls = {}
+    if not variants or "error" in variants:
+        return urls
+    for variant, name in variants.items():
+        if variant == "source":
+            continue
+        url = storage.url(name)
+        urls[variant] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def open_image(storage, name):
+    try:
+        with storage.open(name) as file:
+            image = Image.open(file)
+            width, height = image.size
+            if width * height > settings.IMAGE_MAX_PIXELS:
+                raise ImageProcessingError(f"Image is too large: {width}x{height}")
+            image.verify()
+
+        # Verified image can't be used anymore
+        with storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageProcessingError(str(exc)) from exc
+    return image
+
+
+def process_image(storage, name):
+    """
+    Strip metadata of the stored image, limit its dimensions and save variants.
+
+    Returns names of saved files: "source" is the new original,
+    IMAGE_VARIANTS are saved in JPEG, or PNG for transparent images,
+    and in WebP as "<variant>_webp"
+    """
+    image = open_image(storage, name)
+    # Orientation from EXIF is applied before metadata is dropped
+    image = ImageOps.exif_transpose(image)
+    transparent = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    image = image.convert("RGBA" if transparent else "RGB")
+    image.info = {}
+
+    image_format, extension = ("PNG", "png") if transparent else ("JPEG", "jpg")
+    stem = os.path.splitext(name)[0]
+    variants = {}
+    try:
+        variants["source"] = save_image(
+            storage,
+            resize(image, settings.IMAGE_MAX_DIMENSION),
+            image_format,
+            f"{stem}.{extension}",
+        )
+        for variant, size in settings.IMAGE_VARIANTS.items():
+            resized = resize(image, size)
+            variants[variant] = save_image(
+                storage, resized, image_format, f"{stem}_{variant}.{extension}"
+            )
+            if WEBP:
+                variants[f"{variant}_webp"] = save_image(
+                    storage, resized, "WEBP", f"{stem}_{variant}.webp"
+                )
+    except Exception:
+        delete_files(storage, variants)
+        raise
+    return variants
+
+
+def resize(image, size):
+    """Copy of the image which longest side is size at most"""
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def save_image(storage, image, image_format, name):
+    """Save with digest of content in the name, see project.media"""
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.IMAGE_QUALITY, optimize=True)
+    content = buffer.getvalue()
+    stem, extension = os.path.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[: settings.MEDIA_DIGEST_LENGTH]
+    return storage.save(f"{stem}.{digest}{extension}", ContentFile(content))
+
+
+def delete_files(storage, variants):
+    for variant, name in variants.items():
+        if variant != "error":
+            storage.delete(name)
+
+
+def process_pending(model, batch_size, **values):
+    """
+    Process images of model instances which have no variants yet.
+
+    Results are written only if the image wasn't changed meanwhile,
+    with extra values, returns how many images were processed
+    """
+    field = model.image_field
+    variants_field = f"{field}_variants"
+    storage = model._meta.get_field(field).storage
+    pending = model.objects.filter(**{f"{field}__gt": "", variants_field: {}})
+    rows = list(pending.order_by("pk").values_list("pk", field)[:batch_size])
+
+    for pk, name in rows:
+        try:
+            variants = process_image(storage, name)
+        except ImageProcessingError as exc:
+            variants = {"error": str(exc)}
+            result = {variants_field: variants}
+        else:
+            result = {field: variants["source"], variants_field: variants}
+
+        unchanged = model.objects.filter(pk=pk, **{field: name, variants_field: {}})
+        if unchanged.update(**result, **values):
+            # Original with metadata isn't served anymore
+            if "source" in variants:
+                storage.delete(name)
+        else:
+            delete_files(storage, variants)
+    return len(rows)
@@ -0,0 +1,144 @@
+"""
+Serving of MEDIA_ROOT files with range requests and caching headers.
+
+Behind nginx set MEDIA_ACCEL_REDIRECT to an internal location of MEDIA_ROOT,
+then the proxy sends files and Django only checks and answers headers
+"""
+
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_content_addressed(path):
+    """Name contains digest of the content, see project.images.save_image"""
+    stem = os.path.splitext(path)[0]
+    digest = os.path.splitext(stem)[1][1:]
+    return len(digest) == settings.MEDIA_DIGEST_LENGTH and all(
+        char in "0123456789abcdef" for char in digest
+    )
+
+
+class FileRange:
+    """Reads length bytes of the file from its current position"""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_range(request, size, etag, last_modified):
+    """
+    First and last byte of the requested range.
+
+    None when the whole file is sent: no or several ranges are requested,
+    or "If-Range" doesn't match the file. False when it's unsatisfiable
+    """
+    match = RANGE.match(request.headers.get("Range", ""))
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    if_range = request.headers.get("If-Range")
+    if if_range is not None and if_range != etag:
+        if parse_http_date_safe(if_range) != last_modified:
+            return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix of given length
+        if int(last) == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        return False
+    if first > last:
+        return None
+    return first, last
+
+
+@require_safe
+def serve_media(request, path):
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("File doesn't exist")
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404("File doesn't exist")
+
+    # Files are replaced, not changed in place, so this is strong enough
+    etag = quote_etag(f"{info.st_mtime_ns:x}-{info.st_size:x}")
+    last_modified = int(info.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            location = settings.MEDIA_ACCEL_REDIRECT.rstrip("/") + "/" + quote(path)
+            response["X-Accel-Redirect"] = location
+        else:
+            byte_range = get_range(request, info.st_size, etag, last_modified)
+            response = file_response(full_path, info.st_size, content_type, byte_range)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    if is_content_addressed(path):
+        patch_cache_control(
+            response, public=True, max_age=365 * 24 * 60 * 60, immutable=True
+        )
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_MAX_AGE)
+    return response
+
+
+def file_response(full_path, size, content_type, byte_range):
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    file = open(full_path, "rb")
+    if byte_range is None:
+        # Sent by sendfile() when the server provides wsgi.file_wrapper
+        return FileResponse(file, content_type=content_type)
+
+    first, last = byte_range
+    length = last - first + 1
+    file.seek(first)
+    # Range up to the end of file can still be sent by sendfile()
+    body = file if last == size - 1 else FileRange(file, length)
+    response = FileResponse(body, status=206, content_type=content_type)
+    response["Content-Length"] = length
+    response["Content-Range"] = f"bytes {first}-{last}/{size}"
+    return response
@@ -89,10 +89,22 @@ DATABASES = {
         "PASSWORD": env("POSTGRES_PASSWORD"),
         "HOST": env("POSTGRES_HOST", default="localhost"),
         "PORT": env("POSTGRES_PORT"),
+        # Seconds a connection is reused for, 0 closes it after every request
+        "CONN_MAX_AGE": env.int("CONN_MAX_AGE", default=0),
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+# Local memory is seen by one process only, enough for runserver and tests.
+# Several processes, e.g. workers and process_images or send_outbox commands,
+# need a shared cache, otherwise they serve responses and tokens dropped
+# by another process, see project.caches
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -134,6 +146,26 @@ STATIC_URL = "/static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
 
+# Media files are served by project.media: internal location of MEDIA_ROOT
+# for X-Accel-Redirect when nginx sends them, max age of files which names
+# don't have a content digest of MEDIA_DIGEST_LENGTH hex digits
+MEDIA_ACCEL_REDIRECT = env("MEDIA_ACCEL_REDIRECT", default="")
+MEDIA_MAX_AGE = env.int("MEDIA_MAX_AGE", default=60 * 60)
+MEDIA_DIGEST_LENGTH = 12
+
+# Larger uploads are streamed to a temporary file instead of memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int("FILE_UPLOAD_MAX_MEMORY_SIZE", default=256 * 1024)
+
+# Uploaded images: largest accepted file and number of pixels
+IMAGE_MAX_UPLOAD_BYTES = env.int("IMAGE_MAX_UPLOAD_BYTES", default=10 * 1024 * 1024)
+IMAGE_MAX_PIXELS = env.int("IMAGE_MAX_PIXELS", default=40_000_000)
+
+# Images are processed by process_images command: longest side of stored
+# original and of each variant, and quality of JPEG and WebP files
+IMAGE_MAX_DIMENSION = env.int("IMAGE_MAX_DIMENSION", default=2560)
+IMAGE_VARIANTS = {"thumbnail": 320, "medium": 1024}
+IMAGE_QUALITY = env.int("IMAGE_QUALITY", default=85)
+
 
 # REST_FRAMEWORK settings
 REST_FRAMEWORK = {
@@ -153,7 +185,71 @@ OAUTH2_PROVIDER = {
         "read": "Read scope",
         "write": "Write scope",
         "groups": "Access to your groups",
-    }
+    },
+    "OAUTH2_VALIDATOR_CLASS": "accounts.oauth2_validators.CachedOAuth2Validator",
 }
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+# Validated access tokens: seconds they are kept in shared cache and in process
+# memory, the latter also bounds how long other processes accept revoked ones
+ACCOUNTS_TOKEN_CACHE_TIMEOUT = env.int("ACCOUNTS_TOKEN_CACHE_TIMEOUT", default=300)
+ACCOUNTS_TOKEN_LOCAL_TIMEOUT = env.float("ACCOUNTS_TOKEN_LOCAL_TIMEOUT", default=5)
+ACCOUNTS_TOKEN_LOCAL_MAX_SIZE = env.int("ACCOUNTS_TOKEN_LOCAL_MAX_SIZE", default=10000)
+
+# Text search configuration used for topic full-text search
+FORUM_SEARCH_CONFIG = env("FORUM_SEARCH_CONFIG", default="english")
+
+# How long responses for anonymous users are cached, writes drop them earlier.
+# 0 turns the cache off
+FORUM_RESPONSE_CACHE_TIMEOUT = env.int("FORUM_RESPONSE_CACHE_TIMEOUT", default=300)
+# Count hits and misses for response_cache_stats command
+FORUM_RESPONSE_CACHE_STATS = env.bool("FORUM_RESPONSE_CACHE_STATS", default=False)
+
+# Rendered comments: memory limit of in-process tier and shared cache timeout
+FORUM_COMMENT_FRAGMENTS_MAX_BYTES = env.int(
+    "FORUM_COMMENT_FRAGMENTS_MAX_BYTES", default=16 * 1024 * 1024
+)
+FORUM_COMMENT_FRAGMENTS_TIMEOUT = env.int(
+    "FORUM_COMMENT_FRAGMENTS_TIMEOUT", default=24 * 60 * 60
+)
+
+# How long ids of topics a moderator is attached to are cached,
+# assignments drop them earlier
+FORUM_MODERATED_TOPICS_TIMEOUT = env.int(
+    "FORUM_MODERATED_TOPICS_TIMEOUT", default=60 * 60
+)
+
+# Topic title autocomplete: minimal trigram word similarity and max results
+FORUM_AUTOCOMPLETE_THRESHOLD = env.float("FORUM_AUTOCOMPLETE_THRESHOLD", default=0.3)
+FORUM_AUTOCOMPLETE_LIMIT = env.int("FORUM_AUTOCOMPLETE_LIMIT", default=10)
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Email outbox, see send_outbox command: emails sent per batch and retries,
+# which wait twice as long after every failed attempt up to the max delay
+ACCOUNTS_OUTBOX_BATCH_SIZE = env.int("ACCOUNTS_OUTBOX_BATCH_SIZE", default=100)
+ACCOUNTS_OUTBOX_MAX_ATTEMPTS = env.int("ACCOUNTS_OUTBOX_MAX_ATTEMPTS", default=8)
+ACCOUNTS_OUTBOX_RETRY_SECONDS = env.int("ACCOUNTS_OUTBOX_RETRY_SECONDS", default=30)
+ACCOUNTS_OUTBOX_RETRY_MAX_SECONDS = env.int(
+    "ACCOUNTS_OUTBOX_RETRY_MAX_SECONDS", default=60 * 60
+)
+# Rows fetched from server-side cursor and written at once by streaming exports
+FORUM_EXPORT_CHUNK_SIZE = env.int("FORUM_EXPORT_CHUNK_SIZE", default=2000)
+
+# Most comments accepted by one bulk create request
+FORUM_BULK_COMMENTS_MAX = env.int("FORUM_BULK_COMMENTS_MAX", default=100)
+
+# Change feed: rows per response and how old a change must be to be listed,
+# so writes committed later with an earlier "updated" aren't skipped
+FORUM_CHANGES_LIMIT = env.int("FORUM_CHANGES_LIMIT", default=100)
+FORUM_CHANGES_SETTLE_SECONDS = env.float("FORUM_CHANGES_SETTLE_SECONDS", default=2)
+
+# Comment streams: NOTIFY channel, heartbeat interval and how many events
+# are kept for a slow client before its stream is closed
+FORUM_STREAM_CHANNEL = env("FORUM_STREAM_CHANNEL", default="forum_comments")
+FORUM_STREAM_HEARTBEAT_SECONDS = env.float("FORUM_STREAM_HEARTBEAT_SECONDS", default=15)
+FORUM_STREAM_QUEUE_SIZE = env.int("FORUM_STREAM_QUEUE_SIZE", default=100)
+
+# ASGI deployment: read endpoints are async views running ORM work
+# in a pool of this many threads, see project.threadpool
+FORUM_ASYNC_VIEWS = env.bool("FORUM_ASYNC_VIEWS", default=False)
+FORUM_ASYNC_THREADS = env.int("FORUM_ASYNC_THREADS", default=16)
@@ -0,0 +1,67 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from rest_framework.permissions import SAFE_METHODS
+
+# Every thread keeps its own database connection, so the pool size
+# bounds connections opened by async code of the process
+executor = ThreadPoolExecutor(
+    max_workers=settings.FORUM_ASYNC_THREADS, thread_name_prefix="orm"
+)
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Run blocking ORM code in the bounded pool"""
+
+    def inner():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return await asyncio.get_event_loop().run_in_executor(executor, inner)
+
+
+def database_sync_to_async(func):
+    """Decorator turning blocking function or method into coroutine, see run_in_pool"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_pool(func, *args, **kwargs)
+
+    return wrapper
+
+
+def _render(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    return response
+
+
+def read_view(view):
+    """
+    Async version of the view if FORUM_ASYNC_VIEWS is on.
+
+    Reads run concurrently in the pool, writes go the same way
+    as sync views do under ASGI
+    """
+    if not settings.FORUM_ASYNC_VIEWS:
+        return view
+
+    write_view = sync_to_async(view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await run_in_pool(_render, view, request, *args, **kwargs)
+        return await write_view(request, *args, **kwargs)
+
+    return wrapper
@@ -1,14 +1,17 @@
 """project URL Configuration """
 
+import re
+
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from .media import serve_media
+
 
 urlpatterns = [
     path("api/v1/api-auth/", include("rest_framework.urls")),
@@ -53,5 +56,11 @@ urlpatterns += [
     ),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Served in production too, see project.media
+urlpatterns += [
+    re_path(
+        r"^{}(?P<path>.*)$".format(re.escape(settings.MEDIA_URL.lstrip("/"))),
+        serve_media,
+        name="media",
+    )
+]
@@ -0,0 +1,29 @@
+"""
+Default worker and thread counts of the web server, derived from cores.
+
+Used by gunicorn.conf.py and production settings, which size database
+connections of a process by its threads
+"""
+
+import multiprocessing
+
+import environ
+
+env = environ.Env()
+
+
+def default_workers():
+    """Two processes per core plus one"""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def default_threads():
+    """
+    Threads of a WSGI worker: one per core and at least two, as they mostly
+    wait on the database, but no more than DB_MAX_CONNECTIONS of the process
+    """
+    threads = max(multiprocessing.cpu_count(), 2)
+    max_connections = env.int("DB_MAX_CONNECTIONS", default=0)
+    if max_connections:
+        threads = min(threads, max_connections)
+    return threads